@@ -1,3 +1,4 @@
+import asyncio
 from textwrap import dedent
 
 import bugsnag
@@ -130,3 +131,32 @@ def init(app: Sanic):
         project_root="/app",
         release_stage=settings.RELEASE_STAGE,
     )
+
+    @app.before_server_start
+    async def load_glyphs(app):
+        utils.glyphs.load_all()
+
+    @app.before_server_start
+    async def check_emoji(app):
+        if settings.DEPLOYED and not utils.emojis.ATLAS.available:
+            raise RuntimeError(f"Emoji atlas missing: {settings.EMOJI_ATLAS}")
+
+    @app.after_server_start
+    async def evict_files(app):
+        interval = settings.IMAGES_EVICTION_INTERVAL
+        app.add_task(utils.images.IMAGES.maintain(interval), name="evict_images")
+        app.add_task(utils.frames.FILES.maintain(interval), name="evict_frames")
+
+    @app.before_server_stop
+    async def finish_writes(app):
+        await asyncio.gather(*views.helpers.BACKGROUND_TASKS)
+
+    @app.after_server_stop
+    async def stop_workers(app):
+        utils.workers.WORKERS.shutdown()
+
+    @app.after_server_stop
+    async def close_caches(app):
+        utils.images.IMAGES.close()
+        utils.frames.FILES.close()
+        utils.images.LAYOUTS.close()
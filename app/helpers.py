@@ -1,7 +1,7 @@
 from sanic import Request
 
 from . import settings, utils
-from .models import Template
+from .models import Font, Template
 
 
 def get_valid_templates(
@@ -74,3 +74,20 @@ def get_test_images(request: Request) -> list[str]:
         )
         for id, lines, extension in images
     ]
+
+
+def get_cache_stats() -> dict:
+    return {
+        "fonts": Font.objects.stats(),
+        "images": utils.images.IMAGES.stats(),
+        "admission": utils.images.ADMISSION.stats(),
+        "layouts": utils.images.LAYOUTS.stats(),
+        "backgrounds": utils.images.BACKGROUNDS.stats(),
+        "shared_backgrounds": utils.images.SHARED_BACKGROUNDS.stats(),
+        "resized_backgrounds": utils.images.RESIZED_BACKGROUNDS.stats(),
+        "shared_resized_backgrounds": utils.images.SHARED_RESIZED_BACKGROUNDS.stats(),
+        "blurred_backgrounds": utils.images.BLURRED_BACKGROUNDS.stats(),
+        "watermarks": utils.images.WATERMARKS.stats(),
+        "emoji": utils.emojis.ATLAS.stats(),
+        "workers": utils.workers.WORKERS.stats(),
+    }
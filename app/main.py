@@ -27,6 +27,13 @@ async def test(request: Request):
     return response.html(content)
 
 
+@app.get("/stats")
+@openapi.exclude(True)
+async def stats(request: Request):
+    stats = await asyncio.to_thread(helpers.get_cache_stats)
+    return response.json(stats)
+
+
 @app.get("/favicon.ico")
 @openapi.exclude(True)
 async def favicon(request: Request):
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
 from dataclasses import KW_ONLY, dataclass
+from functools import lru_cache
 from pathlib import Path
 
+from PIL import ImageFont
 from sanic import Request
 
 from .. import settings
@@ -21,6 +23,16 @@ class Manager:
     def all() -> list[Font]:
         return FONTS
 
+    @staticmethod
+    def stats() -> dict:
+        info = _load.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+        }
+
 
 @dataclass
 class Font:
@@ -35,6 +47,9 @@ class Font:
     def path(self) -> Path:
         return settings.ROOT / "fonts" / self.filename
 
+    def load(self, size: int) -> ImageFont.FreeTypeFont:
+        return _load(self.id, size)
+
     def jsonify(self, request: Request) -> dict:
         return {
             "id": self.id,
@@ -52,6 +67,13 @@ class Font:
         )
 
 
+@lru_cache(maxsize=settings.FONT_CACHE_SIZE)
+def _load(id: str, size: int) -> ImageFont.FreeTypeFont:
+    # FreeType memory-maps the file, so every size shares one copy of the font
+    path = Font.objects.get(id).path
+    return ImageFont.truetype(str(path), size=size)
+
+
 FONTS = [
     Font("TitilliumWeb-Black.ttf", "titilliumweb", alias="thick"),
     Font("NotoSans-Bold.ttf", "notosans"),
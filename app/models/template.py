@@ -285,7 +285,8 @@ class Template:
             identifier += str(frames)
         fingerprint = utils.text.fingerprint(identifier, prefix="")
         filename = f"{slug}.{fingerprint}.{extension}"
-        return Path(self.id) / filename
+        # Shard by the whole filename so each text lands in its own directory
+        return Path(self.id, *utils.text.shards(filename)) / filename
 
     @classmethod
     async def create(cls, url: str, *, force=False) -> "Template":
@@ -326,15 +327,20 @@ class Template:
             logger.info(f"Found background {url} at {path}")
             return template
 
-        logger.info(f"Saving background {url} to {path}")
-        if not await utils.http.download(url, path):
-            return template
+        async with utils.leases.Lease(Path(path)) as lease:
+            if lease.waited and await path.exists() and not force:
+                logger.info(f"Found background {url} downloaded to {path}")
+                return template
 
-        try:
-            await asyncio.to_thread(utils.images.load, Path(path))
-        except utils.images.EXCEPTIONS as e:
-            logger.error(e)
-            await path.unlink(missing_ok=True)
+            logger.info(f"Saving background {url} to {path}")
+            if not await utils.http.download(url, path):
+                return template
+
+            try:
+                await asyncio.to_thread(utils.images.load, Path(path))
+            except utils.images.EXCEPTIONS as e:
+                logger.error(e)
+                await path.unlink(missing_ok=True)
 
         return template
 
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 ROOT = Path(__file__).parent.parent.resolve()
@@ -30,13 +31,60 @@ DEPLOYED = RELEASE_STAGE != "local" and not DEBUG
 DEFAULT_FONT = "thick"
 
 MINIMUM_FONT_SIZE = 7
+MAXIMUM_LINES = 4
+
+FONT_CACHE_SIZE = int(os.getenv("FONT_CACHE_SIZE", "512"))
+
+EMOJI_ATLAS = ROOT / "fonts" / "_emoji"  # built by 'make compile' or on deploy
 
 # Image rendering
 
 IMAGES_DIRECTORY = ROOT / "images"
-
-ALLOWED_EXTENSIONS = {"gif", "jpg", "jpeg", "png", "webp"}
+CACHE_DIRECTORY = Path(  # node-local, unlike IMAGES_DIRECTORY which may be shared
+    os.getenv("CACHE_DIRECTORY", Path(tempfile.gettempdir()) / "memegen")
+)
+FRAMES_DIRECTORY = CACHE_DIRECTORY / "frames"  # mapped, so keep on the node
+FRAMES_DIRECTORY_SIZE = int(os.getenv("FRAMES_DIRECTORY_SIZE", str(1024**3)))
+
+IMAGES_DIRECTORY_SIZE = int(os.getenv("IMAGES_DIRECTORY_SIZE", str(4 * 1024**3)))
+IMAGES_EVICTION_INTERVAL = int(os.getenv("IMAGES_EVICTION_INTERVAL", "60"))
+IMAGES_SCAN_INTERVAL = int(os.getenv("IMAGES_SCAN_INTERVAL", "3600"))
+IMAGES_ADMISSION_THRESHOLD = int(os.getenv("IMAGES_ADMISSION_THRESHOLD", "2"))
+
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", "10000"))
+LAYOUT_STORE_SIZE = int(os.getenv("LAYOUT_STORE_SIZE", "200000"))  # rows on disk
+BACKGROUND_CACHE_SIZE = int(os.getenv("BACKGROUND_CACHE_SIZE", str(128 * 1024**2)))
+SHARED_BACKGROUNDS_DIRECTORY = Path(  # mapped, so keep on a node-local tmpfs
+    os.getenv(
+        "SHARED_BACKGROUNDS_DIRECTORY",
+        (
+            Path("/dev/shm/memegen")
+            if Path("/dev/shm").is_dir()
+            else CACHE_DIRECTORY / "shared"
+        ),
+    )
+)
+SHARED_BACKGROUNDS_SIZE = int(  # or half of the space left, if that's smaller
+    os.getenv("SHARED_BACKGROUNDS_SIZE", str(512 * 1024**2))
+)
+RESIZED_BACKGROUND_CACHE_SIZE = int(
+    os.getenv("RESIZED_BACKGROUND_CACHE_SIZE", str(64 * 1024**2))
+)
+RESIZED_BACKGROUND_PERSISTENCE = (
+    os.environ.get("RESIZED_BACKGROUND_PERSISTENCE", "false") == "true"
+)
+RESIZED_BACKGROUNDS_DIRECTORY = CACHE_DIRECTORY / "resized"
+RESIZED_BACKGROUNDS_SIZE = int(
+    os.getenv("RESIZED_BACKGROUNDS_SIZE", str(256 * 1024**2))
+)
+BLURRED_BACKGROUND_CACHE_SIZE = int(
+    os.getenv("BLURRED_BACKGROUND_CACHE_SIZE", str(32 * 1024**2))
+)
+
+ALLOWED_EXTENSIONS = {"auto", "gif", "jpg", "jpeg", "png", "webp"}
 ANIMATED_EXTENSIONS = {"gif", "webp"}
+# For 'auto' in order of preference; AVIF is opt-in as it costs far more to encode
+NEGOTIATED_EXTENSIONS = os.getenv("NEGOTIATED_EXTENSIONS", "webp,jpg").split(",")
 
 DEFAULT_STATIC_EXTENSION = os.environ.get("DEFAULT_STATIC_EXTENSION", "png")
 DEFAULT_ANIMATED_EXTENSION = os.environ.get("DEFAULT_ANIMATED_EXTENSION", "gif")
@@ -47,6 +95,18 @@ PLACEHOLDER_SUFFIX = ".img"
 PREVIEW_SIZE = (300, 300)
 DEFAULT_SIZE = (600, 600)
 
+LEASE_WAIT = float(os.getenv("LEASE_WAIT", "10"))  # seconds for another render
+LEASE_STALE = float(os.getenv("LEASE_STALE", "60"))  # seconds until abandoned
+
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "thread")  # or 'process'
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))  # as read by gunicorn
+RENDER_PROCESSES = int(  # per server worker, so split the CPUs between them
+    os.getenv("RENDER_PROCESSES", str(max(1, (os.cpu_count() or 1) // SERVER_WORKERS)))
+)
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "0"))  # 0 for unlimited
+
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(60 * 60 * 24 * 365)))
+
 MAXIMUM_PIXELS = 1920 * 1080
 MAXIMUM_FRAMES = 20
 MINIMUM_FRAMES = 5
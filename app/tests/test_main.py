@@ -29,3 +29,11 @@ def describe_test(expect, client):
         expect(response.status) == 200
         expect(response.text.count("img")) > 5
         expect(response.text.count("img")) < 100
+
+
+def describe_stats(expect, client):
+    def it_reports_cache_usage():
+        request, response = client.get("/stats")
+        expect(response.status) == 200
+        expect(response.json["fonts"]).contains("hits")
+        expect(response.json["backgrounds"]).contains("hit_rate")
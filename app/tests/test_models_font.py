@@ -0,0 +1,22 @@
+from ..models import Font
+
+
+def describe_font():
+    def describe_load():
+        def it_reuses_fonts_of_the_same_size(expect):
+            font = Font.objects.get("thick")
+            expect(font.load(42)).is_(font.load(42))
+            expect(font.load(42).size) == 42
+
+        def it_loads_each_size_separately(expect):
+            font = Font.objects.get("thick")
+            expect(font.load(42)).is_not(font.load(43))
+
+        def it_tracks_hits_and_misses(expect):
+            font = Font.objects.get("impact")
+            font.load(99)
+            before = Font.objects.stats()
+            font.load(99)
+            after = Font.objects.stats()
+            expect(after["hits"]) == before["hits"] + 1
+            expect(after["misses"]) == before["misses"]
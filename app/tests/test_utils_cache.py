@@ -0,0 +1,269 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import utils
+
+
+def write(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+
+
+def count(path, times):
+    sketch = utils.cache.Sketch(path, width=1024)
+    for _ in range(times):
+        sketch.add("key")
+
+
+def describe_cache():
+    def it_evicts_the_least_recently_used_item(expect):
+        cache = utils.cache.Cache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        expect(cache.get("a")) == 1
+        expect(cache.get("b")) == None
+        expect(cache.stats()["evictions"]) == 1
+
+    def it_can_be_bounded_by_weight(expect):
+        cache = utils.cache.Cache(10, weigh=len)
+        cache.set("a", "x" * 6)
+        cache.set("b", "x" * 6)
+        expect(len(cache)) == 1
+        expect(cache.size) == 6
+
+    def it_skips_items_heavier_than_the_limit(expect):
+        cache = utils.cache.Cache(10, weigh=len)
+        cache.set("a", "x" * 11)
+        expect(len(cache)) == 0
+
+    def it_tracks_the_hit_rate(expect):
+        cache = utils.cache.Cache(2)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        expect(cache.stats()["hit_rate"]) == 0.5
+
+
+def describe_store():
+    def it_persists_values_across_instances(expect, tmp_path):
+        path = tmp_path / "cache.db"
+        utils.cache.Store(path, "items", maxsize=10, maxrows=100).set("a", [1, 2])
+        store = utils.cache.Store(path, "items", maxsize=10, maxrows=100)
+        expect(store.get("a")) == [1, 2]
+        expect(store.stats()["disk_hits"]) == 1
+
+    def it_memoizes_functions_by_arguments(expect, tmp_path):
+        store = utils.cache.Store(
+            tmp_path / "cache.db", "items", maxsize=10, maxrows=100
+        )
+        calls = []
+
+        @store.memoize
+        def double(value):
+            calls.append(value)
+            return value * 2
+
+        expect(double(2)) == 4
+        expect(double(2)) == 4
+        expect(double(3)) == 6
+        expect(calls) == [2, 3]
+
+    def it_separates_versions(expect, tmp_path):
+        path = tmp_path / "cache.db"
+        old = utils.cache.Store(path, "items", maxsize=10, maxrows=100, version="1")
+        new = utils.cache.Store(path, "items", maxsize=10, maxrows=100, version="2")
+        old.memoize(lambda: "old")()
+        expect(new.memoize(lambda: "new")()) == "new"
+
+    def it_drops_rows_from_other_versions(expect, tmp_path):
+        path = tmp_path / "cache.db"
+        utils.cache.Store(path, "items", maxsize=10, maxrows=100, version="1").set(
+            "a", 1
+        )
+        utils.cache.Store(path, "items", maxsize=10, maxrows=100, version="2").get("a")
+        old = utils.cache.Store(path, "items", maxsize=10, maxrows=100, version="1")
+        expect(old.get("a")) == None
+
+    def it_caps_the_number_of_rows(expect, tmp_path):
+        store = utils.cache.Store(tmp_path / "cache.db", "items", maxsize=10, maxrows=3)
+        for key in "abc":
+            store.set(key, key)
+        store.get("a")
+        store.set("d", "d")
+
+        expect(store.stats()["disk_evictions"]) == 1
+        store.memory.clear()
+        expect([store.get(key) for key in "abcd"]) == ["a", None, "c", "d"]
+
+    def it_reopens_connections_after_closing(expect, tmp_path):
+        store = utils.cache.Store(
+            tmp_path / "cache.db", "items", maxsize=10, maxrows=100
+        )
+        store.set("a", 1)
+        store.close()
+        store.memory.clear()
+        expect(store.get("a")) == 1
+        store.close()
+
+
+def describe_files():
+    def it_evicts_the_least_recently_used_files(expect, tmp_path):
+        files = utils.cache.Files(tmp_path, maxsize=250)
+        for name in "abc":
+            path = tmp_path / "iw" / f"{name}.png"
+            write(path, 100)
+            files.add(path)
+        files.touch(tmp_path / "iw" / "a.png")
+
+        expect(files.evict(batch=1)) == 1
+        expect(sorted(path.name for path in (tmp_path / "iw").iterdir())) == [
+            "a.png",
+            "c.png",
+        ]
+        expect(files.stats()["size"]) == 200
+        expect(files.stats()["evictions"]) == 1
+
+    def it_indexes_existing_files(expect, tmp_path):
+        write(tmp_path / "iw" / "old.png", 100)
+        files = utils.cache.Files(tmp_path, maxsize=1000)
+        files.evict()
+        expect(files.stats()["items"]) == 1
+
+    def it_skips_internal_caches(expect, tmp_path):
+        write(tmp_path / "_frames" / "abc" / "1.rgba", 100)
+        write(tmp_path / "iw" / ".lease", 100)
+        write(tmp_path / "_layouts.db", 100)
+        write(tmp_path / "_error" / "text.png", 100)
+        files = utils.cache.Files(tmp_path, maxsize=0, exclude={tmp_path / "_frames"})
+
+        expect(files.evict()) == 1
+        expect((tmp_path / "_error" / "text.png").exists()) == False
+        expect((tmp_path / "_frames" / "abc" / "1.rgba").exists()) == True
+        expect((tmp_path / "iw" / ".lease").exists()) == True
+        expect((tmp_path / "_layouts.db").exists()) == True
+
+    def it_elects_one_process_to_evict(expect, tmp_path):
+        directory = tmp_path / "images"
+        for name in "abc":
+            write(directory / "iw" / f"{name}.png", 100)
+        first = utils.cache.Files(directory, maxsize=150, index=tmp_path / "first.db")
+        second = utils.cache.Files(directory, maxsize=150, index=tmp_path / "second.db")
+        for name in "abc":
+            second.add(directory / "iw" / f"{name}.png")
+
+        try:
+            expect(second.check()) == 2
+            expect(first.check()) == 0
+        finally:
+            second.lease.release()
+
+        expect(len(list((directory / "iw").iterdir()))) == 1
+        expect(second.stats()["evictions"]) == 2
+
+    def it_leaves_the_index_to_the_elected_process(expect, tmp_path):
+        directory = tmp_path / "images"
+        files = utils.cache.Files(directory, maxsize=150, index=tmp_path / "a.db")
+        for name in "abc":
+            write(directory / "iw" / f"{name}.png", 100)
+            files.add(directory / "iw" / f"{name}.png")
+        other = utils.leases.Lease(directory / "_eviction")
+        other.acquire()
+
+        try:
+            expect(files.check()) == 0
+        finally:
+            other.release()
+
+        expect(len(list((directory / "iw").iterdir()))) == 3
+        expect(files.stats()["items"]) == 3
+
+        try:
+            expect(files.check()) == 2
+        finally:
+            files.lease.release()
+
+        expect(len(list((directory / "iw").iterdir()))) == 1
+
+    def it_keeps_no_index_when_evicting_on_another_node(expect, tmp_path):
+        directory = tmp_path / "images"
+        files = utils.cache.Files(directory, maxsize=150, index=tmp_path / "a.db")
+        write(directory / "iw" / "a.png", 100)
+        files.add(directory / "iw" / "a.png")
+        other = utils.leases.Lease(directory / "_eviction")
+        other.token = "elsewhere:1:abc"
+        other.acquire()
+
+        try:
+            expect(files.check()) == 0
+            write(directory / "iw" / "b.png", 100)
+            files.add(directory / "iw" / "b.png")
+            expect(files.stats()["items"]) == None
+        finally:
+            other.release()
+
+        expect(files.connection.execute("SELECT * FROM files").fetchall()) == []
+
+    def it_keeps_files_accessed_by_other_processes(expect, tmp_path):
+        directory = tmp_path / "images"
+        files = utils.cache.Files(directory, maxsize=250, index=tmp_path / "a.db")
+        other = utils.cache.Files(directory, maxsize=250, index=tmp_path / "b.db")
+        for name in "abc":
+            write(directory / "iw" / f"{name}.png", 100)
+            files.add(directory / "iw" / f"{name}.png")
+        other.touch(directory / "iw" / "a.png")
+        other.flush()
+
+        expect(files.evict()) == 1
+        expect(sorted(path.name for path in (directory / "iw").iterdir())) == [
+            "a.png",
+            "c.png",
+        ]
+
+    def it_tracks_the_hit_rate(expect, tmp_path):
+        files = utils.cache.Files(tmp_path, maxsize=1000)
+        path = tmp_path / "iw" / "a.png"
+        write(path, 10)
+        files.add(path)
+        files.touch(path)
+        files.touch(tmp_path / "elsewhere.png")
+        expect(files.stats()["hit_rate"]) == 0.5
+
+
+def describe_sketch():
+    def it_estimates_frequencies(expect, tmp_path):
+        sketch = utils.cache.Sketch(tmp_path / "sketch.bin", width=1024)
+        for _ in range(3):
+            sketch.add("popular")
+        sketch.add("rare")
+        expect(sketch.estimate("popular")) == 3
+        expect(sketch.estimate("rare")) == 1
+        expect(sketch.estimate("unseen")) == 0
+
+    def it_admits_keys_seen_again(expect, tmp_path):
+        sketch = utils.cache.Sketch(tmp_path / "sketch.bin", width=1024)
+        expect(sketch.admit("key", 2)) == False
+        expect(sketch.admit("key", 2)) == True
+        expect(sketch.stats()["admission_rate"]) == 0.5
+
+    def it_shares_counts_between_processes(expect, tmp_path):
+        utils.cache.Sketch(tmp_path / "sketch.bin", width=1024).add("key")
+        sketch = utils.cache.Sketch(tmp_path / "sketch.bin", width=1024)
+        expect(sketch.estimate("key")) == 1
+
+    def it_counts_every_addition_from_concurrent_processes(expect, tmp_path):
+        path = tmp_path / "sketch.bin"
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(4, mp_context=context) as executor:
+            list(executor.map(count, [path] * 4, [50] * 4))
+
+        expect(utils.cache.Sketch(path, width=1024).estimate("key")) == 200
+
+    def it_ages_counts_periodically(expect, tmp_path):
+        sketch = utils.cache.Sketch(tmp_path / "sketch.bin", width=16)
+        for _ in range(10):
+            sketch.add("old")
+        for index in range(sketch.sample - 10):
+            sketch.add(str(index))
+        expect(sketch.estimate("old")) < 10
@@ -0,0 +1,119 @@
+import io
+import socket
+
+import pytest
+from PIL import Image
+from pilmoji.source import BaseSource
+
+from .. import models, utils
+
+
+@pytest.fixture
+def atlas(tmp_path, monkeypatch):
+    images = [
+        ("🔥", Image.new("RGBA", (72, 72), "red")),
+        ("❤️", Image.new("RGBA", (36, 36), "blue")),
+    ]
+    path = tmp_path / "_emoji"
+    utils.emojis.build(images, path)
+    atlas = utils.emojis.Atlas(path)
+    monkeypatch.setattr(utils.emojis, "ATLAS", atlas)
+    return atlas
+
+
+class Source(BaseSource):
+    def __init__(self, data: bytes = b"", error: Exception | None = None):
+        self.data = data
+        self.error = error
+
+    def get_emoji(self, emoji, /):
+        if self.error:
+            raise self.error
+        return io.BytesIO(self.data)
+
+    def get_discord_emoji(self, id, /):
+        return None
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    def connect(*args, **kwargs):
+        raise AssertionError("network access while rendering")
+
+    monkeypatch.setattr(socket.socket, "connect", connect)
+
+
+def describe_atlas():
+    def it_returns_cells_from_the_atlas(expect, atlas):
+        stream = atlas.get_emoji("🔥")
+        assert stream
+        image = Image.open(stream)
+        expect(image.size) == (72, 72)
+        expect(image.getpixel((36, 36))) == (255, 0, 0, 255)
+
+    def it_resizes_images_to_fit_cells(expect, atlas):
+        stream = atlas.get_emoji("❤️")
+        assert stream
+        image = Image.open(stream)
+        expect(image.size) == (72, 72)
+        expect(image.getpixel((0, 0))) == (0, 0, 255, 255)
+
+    def it_matches_emoji_without_variation_selectors(expect, atlas):
+        expect(atlas.get_emoji("❤")) != None
+
+    def it_skips_unknown_emoji(expect, atlas):
+        expect(atlas.get_emoji("🐍")) == None
+
+    def it_handles_missing_atlas(expect, tmp_path):
+        atlas = utils.emojis.Atlas(tmp_path / "_missing")
+        expect(atlas.get_emoji("🔥")) == None
+        expect(atlas.available) == False
+
+    def it_reports_when_the_atlas_is_available(expect, atlas):
+        expect(atlas.available) == True
+
+    def it_uses_the_fallback_without_an_atlas(expect, tmp_path):
+        fallback = Source(b"image")
+        atlas = utils.emojis.Atlas(tmp_path / "_missing", fallback=fallback)
+        stream = atlas.get_emoji("🔥")
+        assert stream
+        expect(stream.read()) == b"image"
+
+    def it_retries_the_fallback_after_failures(expect, tmp_path):
+        fallback = Source(error=ConnectionError("offline"))
+        atlas = utils.emojis.Atlas(tmp_path / "_missing", fallback=fallback)
+        expect(atlas.get_emoji("🔥")) == None
+
+        fallback.error = None
+        fallback.data = b"image"
+        stream = atlas.get_emoji("🔥")
+        assert stream
+        expect(stream.read()) == b"image"
+
+    def it_ignores_the_fallback_with_an_atlas(expect, atlas):
+        atlas.fallback = Source(b"image")
+        expect(atlas.get_emoji("🐍")) == None
+
+
+def describe_fetch():
+    def it_returns_image_data(expect):
+        expect(utils.emojis.fetch(Source(b"image"), "🔥")) == b"image"
+
+    def it_handles_empty_responses(expect):
+        expect(utils.emojis.fetch(Source(b""), "🔥")) == b""
+
+    def it_handles_network_errors(expect):
+        source = Source(error=ConnectionError("offline"))
+        expect(utils.emojis.fetch(source, "🔥")) == b""
+
+
+def describe_render():
+    def it_draws_emoji_without_network_access(expect, atlas, offline, tmp_path):
+        template = models.Template.objects.get("iw")
+        path = utils.images.save(template, ["🔥🔥🔥", ""], directory=tmp_path)
+
+        image = Image.open(path).convert("RGB")
+        colors = image.getcolors(image.width * image.height)
+        assert colors
+        expect(any(color == (255, 0, 0) for _count, color in colors)) == True
+        expect(len(atlas.streams)) == 1
@@ -0,0 +1,106 @@
+import io
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image, ImageChops, ImageSequence, ImageStat
+
+from .. import models, settings, utils
+
+
+@pytest.fixture
+def animated(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FRAMES_DIRECTORY", tmp_path / "frames")
+    path = tmp_path / "default.gif"
+    shutil.copy(models.Template.objects.get("fine").get_image(animated=True), path)
+    return path
+
+
+def describe_decode():
+    @pytest.mark.parametrize("id", ["fine", "live"])
+    def it_matches_frames_flattened_through_gif(expect, id):
+        path = models.Template.objects.get(id).get_image(animated=True)
+
+        expected = []
+        for frame in ImageSequence.Iterator(Image.open(path)):
+            stream = io.BytesIO()
+            frame.save(stream, format="GIF")
+            expected.append(Image.open(stream).convert("RGBA"))
+        frames = list(utils.frames.decode(Image.open(path)))
+
+        expect(len(frames)) == len(expected)
+        for (frame, duration), previous in zip(frames, expected):
+            expect(duration) > 0
+            expect(frame.mode) == "RGBA"
+            difference = ImageChops.difference(frame, previous)
+            expect(difference.getchannel("A").getbbox()) == None
+            difference = difference.convert("RGB")
+            expect(max(ImageStat.Stat(difference).mean)) < 5
+
+
+def describe_load():
+    def it_matches_decoded_frames(expect, animated):
+        decoded = list(utils.frames.decode(Image.open(animated)))
+        animation = utils.frames.load(animated)
+        assert animation
+
+        expect(len(animation)) == len(decoded)
+        expect(animation.durations) == [duration for _frame, duration in decoded]
+        for frame, (expected, _duration) in zip(animation, decoded):
+            difference = ImageChops.difference(frame, expected)
+            expect(difference.getbbox(alpha_only=False)) == None
+
+    def it_handles_concurrent_first_loads(expect, animated):
+        with ThreadPoolExecutor(8) as executor:
+            animations = list(executor.map(utils.frames.load, [animated] * 16))
+
+        expect(all(animations)) == True
+        directory = utils.frames.get_directory(animated)
+        expect([path.name for path in directory.glob(".*")]) == []
+
+    def it_skips_static_images(expect, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "FRAMES_DIRECTORY", tmp_path / "frames")
+        path = models.Template.objects.get("iw").image
+        expect(utils.frames.load(path)) == None
+
+    def it_rebuilds_evicted_frames(expect, animated):
+        utils.frames.load(animated)
+        for path in utils.frames.get_directory(animated).glob("*.rgba"):
+            path.unlink()
+
+        animation = utils.frames.load(animated)
+        assert animation
+        expect(len(animation)) > 1
+
+    def it_rebuilds_when_the_source_changes(expect, animated):
+        utils.frames.load(animated)
+        directory = utils.frames.get_directory(animated)
+        previous = list(directory.glob("*.rgba"))
+
+        mtime = animated.stat().st_mtime + 10
+        os.utime(animated, (mtime, mtime))
+        animation = utils.frames.load(animated)
+        assert animation
+
+        expect(len(animation)) > 1
+        expect(list(directory.glob("*.rgba"))) != previous
+        expect(len(list(directory.glob("*.rgba")))) == 1
+
+
+def describe_stream():
+    def it_matches_decoded_frames(expect, animated):
+        decoded = list(utils.frames.decode(Image.open(animated)))
+        sequence = utils.frames.stream(animated)
+        assert sequence
+
+        expect(len(sequence)) == len(decoded)
+        expect(sequence.duration) == decoded[0][1]
+        for frame, (expected, _duration) in zip(sequence, decoded):
+            difference = ImageChops.difference(frame, expected)
+            expect(difference.getbbox(alpha_only=False)) == None
+        expect(settings.FRAMES_DIRECTORY.exists()) == False
+
+    def it_skips_static_images(expect):
+        path = models.Template.objects.get("iw").image
+        expect(utils.frames.stream(path)) == None
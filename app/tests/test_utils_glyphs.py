@@ -0,0 +1,39 @@
+import pytest
+
+from .. import utils
+
+
+@pytest.fixture
+def table():
+    return utils.glyphs.load("titilliumweb")
+
+
+def describe_table():
+    def describe_estimate_width():
+        def it_scales_with_text_length(expect, table):
+            width = table.estimate_width("Hello")
+            expect(table.estimate_width("Hello Hello")) > width * 2
+
+        def it_skips_unknown_glyphs(expect, table):
+            expect(table.estimate_width("Hello 👋")) == None
+
+    def describe_estimate_size():
+        def it_is_limited_by_width(expect, table):
+            size = table.estimate_size("A WIDE LINE OF TEXT", 300, 1000)
+            expect(size) < table.estimate_size("A WIDE LINE OF TEXT", 600, 1000)
+
+        def it_is_limited_by_height(expect, table):
+            size = table.estimate_size("A\nB", 1000, 100)
+            expect(size) < table.estimate_size("A", 1000, 100)
+
+        def it_is_zero_for_unknown_glyphs(expect, table):
+            expect(table.estimate_size("👋", 600, 100)) == 0
+
+
+def describe_load():
+    def it_returns_none_without_metrics(expect):
+        expect(utils.glyphs.load("unknown")) == None
+
+    def it_loads_every_table(expect):
+        utils.glyphs.load_all()
+        expect(utils.glyphs.load.cache_info().currsize) >= 8
@@ -6,6 +6,8 @@ import os
 from pathlib import Path
 
 import pytest
+import webp
+from PIL import Image, ImageChops
 
 from .. import models, settings, utils
 
@@ -42,6 +44,56 @@ async def test_animated_text_on_animated_background(images):
     utils.images.save(template, lines, extension="gif", directory=images)
 
 
+def test_animated_text_is_rendered_once_per_visible_lines(expect, monkeypatch):
+    calls = []
+    render_text_box = utils.images.render_text_box
+
+    def render(*args):
+        calls.append(args)
+        return render_text_box(*args)
+
+    monkeypatch.setattr(utils.images, "render_text_box", render)
+    template = models.Template.objects.get("sparta")
+    lines = ["this is", "animated"]
+    frames, _duration = utils.images.render_animation(
+        template, "default", lines, (0, 0)
+    )
+
+    expect(len(calls)) < len(frames) * len(template.text)
+
+
+def test_client_supplied_animations_are_not_stored(expect, monkeypatch, tmp_path):
+    template = models.Template.objects.get("fine")
+    path = tmp_path / "_custom-overlay.gif"
+    path.write_bytes(template.get_image(animated=True).read_bytes())
+    monkeypatch.setattr(template, "get_image", lambda *args, **kwargs: path)
+
+    def load(path):
+        raise AssertionError("stored frames")
+
+    monkeypatch.setattr(utils.frames, "load", load)
+    frames, _duration = utils.images.render_animation(
+        template, "default", ["this is", "animated"], (0, 0)
+    )
+
+    expect(len(frames)) > 1
+
+
+def test_static_text_is_rendered_like_animated_text(expect, monkeypatch):
+    calls = []
+    render_text_box = utils.images.render_text_box
+
+    def render(*args):
+        calls.append(args)
+        return render_text_box(*args)
+
+    monkeypatch.setattr(utils.images, "render_text_box", render)
+    template = models.Template.objects.get("fry")
+    utils.images.render_image(template, "default", ["a", "b"], (0, 0))
+
+    expect(len(calls)) == len(template.text)
+
+
 @pytest.mark.slow
 def test_single_line_is_never_animated(images):
     template = models.Template.objects.get("cbg")
@@ -49,6 +101,98 @@ def test_single_line_is_never_animated(images):
     utils.images.save(template, lines, extension="gif", directory=images)
 
 
+def test_static_webp_is_saved_apart_from_animations(expect, images):
+    template = models.Template.objects.get("icanhas")
+    lines = ["static", "webp"]
+    path = utils.images.save(template, lines, extension="webp", directory=images)
+    static = utils.images.save(
+        template, lines, extension="webp", directory=images, animated=False
+    )
+
+    expect(static) != path
+    expect(static.suffix) == ".webp"
+    expect(Image.open(static).format) == "WEBP"
+
+
+@pytest.mark.parametrize("extension", ["png", "jpg", "gif", "webp"])
+def test_encoding_matches_writing_files(expect, tmp_path, extension):
+    template = models.Template.objects.get("icanhas")
+    lines = ["in", "memory"]
+    path = tmp_path / f"image.{extension}"
+    if extension == "gif":
+        frames, duration = utils.images.render_animation(
+            template, "default", lines, (0, 0)
+        )
+        frames[0].save(
+            path,
+            format=extension,
+            save_all=True,
+            append_images=frames[1:],
+            duration=duration,
+            loop=0,
+        )
+    elif extension == "webp":
+        frames, duration = utils.images.render_animation(
+            template, "default", lines, (0, 0), "", settings.MAXIMUM_FRAMES * 4
+        )
+        fps = round(1 / duration * 1000, 2)
+        webp.save_images(frames, str(path), fps=fps, lossless=False)
+    else:
+        image = utils.images.render_image(template, "default", lines, (0, 0))
+        image.convert("RGB").save(path, quality=95)
+
+    data = utils.images.encode(template, lines, extension=extension)
+
+    expect(path.read_bytes() == data) == True
+
+
+def test_failed_writes_leave_no_temporary_files(expect, monkeypatch, tmp_path):
+    def fail(source, destination):
+        raise OSError("Disk quota exceeded")
+
+    monkeypatch.setattr(os, "replace", fail)
+
+    with pytest.raises(OSError):
+        utils.images.write(tmp_path / "iw" / "image.png", b"image")
+
+    expect(list((tmp_path / "iw").iterdir())) == []
+
+
+def test_images_are_sharded_by_filename(expect, template):
+    first = utils.images.get_path(template, ["first"])
+    second = utils.images.get_path(template, ["second"])
+    expect(first.parts[0]) == second.parts[0] == template.id
+    expect(first.parts[1:3] != second.parts[1:3]) == True
+
+
+def test_shard_moves_existing_images(expect, monkeypatch, tmp_path, template):
+    path = utils.images.get_path(template, ["one", "two"])
+    flat = tmp_path / template.id / "one" / path.name
+    flat.parent.mkdir(parents=True)
+    flat.write_bytes(b"image")
+    monkeypatch.setattr(utils.images.IMAGES, "exclude", {tmp_path / "_frames"})
+    (tmp_path / "_frames").mkdir()
+    (tmp_path / "_frames" / "a.1234567890123456789012345678901234567890.rgba").touch()
+
+    expect(utils.images.shard(tmp_path)) == 1
+    expect((tmp_path / path).read_bytes()) == b"image"
+    expect((tmp_path / template.id / "one").exists()) == False
+    expect(utils.images.shard(tmp_path)) == 0
+
+
+def test_shard_moves_images_sharded_by_fingerprint(expect, tmp_path, template):
+    path = utils.images.get_path(template, ["one", "two"])
+    fingerprint = path.name.split(".")[1]
+    filename = Path(*path.parts[3:])
+    old = tmp_path / template.id / fingerprint[:2] / fingerprint[2:4] / filename
+    old.parent.mkdir(parents=True)
+    old.write_bytes(b"image")
+
+    expect(utils.images.shard(tmp_path)) == 1
+    expect((tmp_path / path).read_bytes()) == b"image"
+    expect(utils.images.shard(tmp_path)) == 0
+
+
 # Size
 
 
@@ -78,6 +222,20 @@ def test_tall_padding(images, template):
     utils.images.save(template, lines, size=(400, 600), directory=images)
 
 
+def test_blurred_padding_is_cached(expect, template):
+    background = utils.images.load(template.image)
+    key = template.image, "test"
+
+    blurred = utils.images.get_blurred_background(background, 600, 400, key)
+    blurred.paste("red", (0, 0, 10, 10))
+    hits = utils.images.BLURRED_BACKGROUNDS.hits
+    cached = utils.images.get_blurred_background(background, 600, 400, key)
+
+    expect(utils.images.BLURRED_BACKGROUNDS.hits) == hits + 1
+    expect(cached.size) == (600, 400)
+    expect(cached.getpixel((0, 0))) != blurred.getpixel((0, 0))
+
+
 def test_small_padding(images, template):
     lines = ["width=50", "height=50"]
     utils.images.save(template, lines, size=(50, 50), directory=images)
@@ -99,6 +257,71 @@ async def test_custom_template(images):
     utils.images.save(template, ["", "My Custom Template"], directory=images)
 
 
+def test_backgrounds_are_decoded_once(expect, tmp_path, template):
+    path = tmp_path / "default.jpg"
+    path.write_bytes(template.image.read_bytes())
+
+    background = utils.images.load_background(path)
+    expect(utils.images.load_background(path)).is_(background)
+
+    os.utime(path, (0, 0))
+    expect(utils.images.load_background(path)).is_not(background)
+
+
+@pytest.mark.parametrize("persistence", [False, True])
+def test_resized_backgrounds_are_copies(expect, monkeypatch, tmp_path, persistence):
+    monkeypatch.setattr(settings, "RESIZED_BACKGROUND_PERSISTENCE", persistence)
+    shared = utils.pixels.Shared(tmp_path, 1024**2)
+    monkeypatch.setattr(utils.images, "SHARED_RESIZED_BACKGROUNDS", shared)
+    utils.images.RESIZED_BACKGROUNDS.clear()
+    path = models.Template.objects.get("iw").image
+    size = 0, 300
+
+    image = utils.images.load_resized_background(path, *size, False, expand=True)
+    color = image.getpixel((0, 0))
+    image.paste("red", (0, 0, 10, 10))
+    cached = utils.images.load_resized_background(path, *size, False, expand=True)
+    utils.images.RESIZED_BACKGROUNDS.clear()
+    loaded = utils.images.load_resized_background(path, *size, False, expand=True)
+
+    expect(cached.getpixel((0, 0))) == color
+    expect(loaded.getpixel((0, 0))) == color
+    expect(len(list(tmp_path.iterdir()))) == (1 if persistence else 0)
+
+
+def test_resized_backgrounds_render_when_persistence_fails(expect, monkeypatch):
+    monkeypatch.setattr(settings, "RESIZED_BACKGROUND_PERSISTENCE", True)
+    shared = utils.pixels.Shared(Path("/dev/null"), 1024**2)
+    monkeypatch.setattr(utils.images, "SHARED_RESIZED_BACKGROUNDS", shared)
+    utils.images.RESIZED_BACKGROUNDS.clear()
+    path = models.Template.objects.get("iw").image
+
+    image = utils.images.load_resized_background(path, 0, 200, False, expand=True)
+
+    expect(image.height) == 200
+
+
+def test_compiled_backgrounds_skip_decoding(expect, monkeypatch, tmp_path, template):
+    path = tmp_path / "default.jpg"
+    path.write_bytes(template.image.read_bytes())
+    compiled_path = utils.images.compile_image(path)
+    expected = utils.images.decode(path)
+    decoded = []
+    monkeypatch.setattr(utils.images, "decode", lambda path: decoded.append(path))
+
+    image = utils.images.load(path)
+    compiled = utils.pixels.load(compiled_path)
+    assert compiled
+    expect(compiled_path.name) == "_default.jpg.px"
+    expect(compiled.mode) == "RGB"
+    expect(image.mode) == "RGBA"
+    expect(image.tobytes() == expected.tobytes()) == True
+    expect(decoded) == []
+
+    os.utime(path, (0, 0))
+    expect(utils.images.load_compiled(path)) == None
+
+
 def test_unknown_template(images):
     template = models.Template.objects.get("_error")
     utils.images.save(template, ["UNKNOWN TEMPLATE"], directory=images)
@@ -200,6 +423,45 @@ def test_text_wrap_on_smaller_images(images):
     utils.images.save(template, lines, size=(0, 200), directory=images)
 
 
+def test_text_wrap_with_many_lines(expect):
+    line = "the number of sample memes is too damn high for a single line"
+    text = utils.images.wrap("thick", line, (300, 300), 100)
+    expect(text.count("\n")) >= 2
+    expect(text.split()) == line.split()
+
+
+def test_text_wrap_keeps_emoji_with_words(expect):
+    text = utils.images.wrap("thick", "🚀 aaaaa bbb cccc", (400, 400), 100)
+    expect(text.split("\n")) != ["🚀", "aaaaa bbb cccc"]
+
+
+def test_text_wrap_measures_styled_text(expect):
+    template = models.Template.objects.get("ski")
+    lines = [
+        "if you try to put a bunch more text than can possibly fit on a meme",
+        "you're gonna have a bad time",
+    ]
+    elements = utils.images.get_image_elements(template, lines, "", "", (600, 600))
+    element = next(elements)
+    text, font = element[2], element[5]
+    expect(text.isupper()) == True
+    expect(font.size) >= 33  # size before choosing breaks by font size
+
+
+def test_text_wrap_keeps_explicit_newlines(expect):
+    text = utils.images.wrap("thick", "one\ntwo three", (100, 400), 100)
+    expect(text) == "one\ntwo three"
+
+
+@pytest.mark.parametrize(
+    ("maximum", "breaks"),
+    [(1, [[]]), (2, [[], [2]]), (3, [[], [2], [2, 3]])],
+)
+def test_split_lines(expect, maximum, breaks):
+    widths = [10.0, 10.0, 20.0, 10.0]
+    expect(utils.images.split_lines(widths, 1.0, maximum)) == breaks
+
+
 @pytest.mark.slow
 def test_descender_vertical_alignment(images):
     template = models.Template.objects.get("right")
@@ -270,6 +532,81 @@ def test_font_override(images, template):
     utils.images.save(template, lines, font_name="comic", directory=images)
 
 
+@pytest.mark.parametrize("estimate", [0, 7, 8, 20, 30, 45, 99])
+@pytest.mark.parametrize("largest", [7, 8, 19, 44, 45])
+def test_find_font_size(expect, largest, estimate):
+    fits = lambda size: size <= largest
+    size = utils.images.find_font_size(fits, 7, 45, estimate)
+    expect(size) == largest
+
+
+def test_find_font_size_when_nothing_fits(expect):
+    size = utils.images.find_font_size(lambda size: False, 7, 45)
+    expect(size) == 7
+
+
+@pytest.mark.parametrize("font_name", ["", "impact", "comic"])
+@pytest.mark.parametrize(
+    "text", ["a", "Hello", "ONE DOES NOT SIMPLY", "a\nlong\nstack"]
+)
+@pytest.mark.parametrize("max_text_size", [(40, 20), (250, 60), (600, 150), (900, 400)])
+def test_get_font_matches_a_linear_scan(expect, font_name, text, max_text_size):
+    font = models.Font.objects.get(font_name or settings.DEFAULT_FONT)
+    max_font_size = max_text_size[1]
+    max_text_width = max_text_size[0] - max_text_size[0] / 35
+    max_text_height = max_text_size[1] - max_text_size[1] / 10
+
+    def fits(size):
+        width, height = utils.images.get_text_size_minus_font_offset(
+            text, font.load(size)
+        )
+        return width <= max_text_width and height <= max_text_height
+
+    minimum = settings.MINIMUM_FONT_SIZE
+    sizes = range(max(minimum, max_font_size), minimum - 1, -1)
+    expected = next((size for size in sizes if fits(size)), minimum)
+
+    size = utils.images.get_font(font_name, text, max_text_size, max_font_size).size
+    expect(size) == expected
+
+
+def test_text_measurement_allocations(expect, monkeypatch, template):
+    allocations = []
+    measurements: list[tuple | None] = []
+    new = Image.new
+    get_text_size = utils.images.get_text_size
+
+    def allocate(*args, **kwargs):
+        if measurements and measurements[-1] is None:
+            allocations.append(args)
+        return new(*args, **kwargs)
+
+    def measure(*args):
+        measurements.append(None)
+        size = get_text_size(*args)
+        measurements[-1] = args
+        return size
+
+    utils.images.get_text_size("warm up", models.Font.objects.get("thick").load(9))
+    monkeypatch.setattr(Image, "new", allocate)
+    monkeypatch.setattr(utils.images, "get_text_size", measure)
+    monkeypatch.setattr(utils.images.LAYOUTS, "get", lambda key: None)
+
+    lines = ["measuring text", "should not allocate images"]
+    utils.images.render_image(template, "default", lines, (0, 0))
+
+    expect(len(measurements)) > 20
+    expect(len(allocations)) == 0
+
+
+def test_layout_version_covers_fitting_settings(expect, monkeypatch):
+    version = utils.images.LAYOUTS.version
+    expect(utils.images._get_layout_version()) == version
+
+    monkeypatch.setattr(settings, "MAXIMUM_LINES", settings.MAXIMUM_LINES + 1)
+    expect(utils.images._get_layout_version()) != version
+
+
 def test_text_not_cut_off_with_impact_and_watermark(images):
     template = models.Template.objects.get("fry")
     lines = ["", ("enjoy " * 7).strip()]
@@ -286,6 +623,23 @@ def test_watermark(images, template):
     utils.images.save(template, lines, "Example.com", directory=images)
 
 
+@pytest.mark.parametrize(("is_preview", "index"), [(False, 0), (True, 0), (False, 3)])
+def test_watermark_only_covers_its_strip(expect, is_preview, index):
+    image = Image.new("RGBA", (300, 200), "gray")
+    label = "Memegen.link"
+
+    watermarked = utils.images.add_watermark(image.copy(), label, is_preview, index, 10)
+    sprite, top = utils.images.get_watermark_sprite(label, image.size, is_preview)
+
+    box = ImageChops.difference(image, watermarked).getbbox(alpha_only=False)
+    assert box
+    left, upper, _right, lower = box
+    expect(left) >= index
+    expect(upper) >= top
+    expect(lower) <= top + sprite.height
+    expect(sprite.height) < settings.WATERMARK_HEIGHT * 2
+
+
 def test_watermark_with_padding(images, template):
     lines = ["padded image", "with watermark"]
     utils.images.save(template, lines, "Example.com", size=(500, 500), directory=images)
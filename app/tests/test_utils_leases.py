@@ -0,0 +1,128 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import utils
+
+
+def produce(path, start):
+    time.sleep(max(0, start - time.time()))  # so that every process contends
+    with utils.leases.Lease(path) as lease:
+        assert lease.acquired
+        if path.exists():
+            return False
+        time.sleep(0.2)
+        utils.images.write(path, str(os.getpid()).encode())
+        return True
+
+
+def describe_lease():
+    def it_allows_one_holder(expect, tmp_path):
+        path = tmp_path / "image.png"
+        first = utils.leases.Lease(path)
+        second = utils.leases.Lease(path)
+
+        expect(first.acquire()) == True
+        expect(second.acquire()) == False
+        first.release()
+        expect(second.acquire()) == True
+
+    def it_waits_for_the_holder(expect, tmp_path):
+        path = tmp_path / "image.png"
+        first = utils.leases.Lease(path)
+        first.acquire()
+        threading.Timer(0.1, first.release).start()
+
+        with utils.leases.Lease(path, wait=5) as second:
+            expect(second.acquired) == True
+            expect(second.waited) == True
+
+    def it_stops_waiting_eventually(expect, tmp_path):
+        path = tmp_path / "image.png"
+        utils.leases.Lease(path).acquire()
+
+        with utils.leases.Lease(path, wait=0.1) as lease:
+            expect(lease.acquired) == False
+            expect(lease.waited) == True
+
+    def it_breaks_stale_leases(expect, tmp_path):
+        path = tmp_path / "image.png"
+        first = utils.leases.Lease(path)
+        first.acquire()
+        mtime = time.time() - 120
+        os.utime(first.lock, (mtime, mtime))
+
+        second = utils.leases.Lease(path, stale=60)
+        expect(second.acquire()) == True
+        first.release()
+        expect(second.lock.exists()) == True
+        expect(list(tmp_path.iterdir())) == [second.lock]
+
+    def it_keeps_leases_refreshed_while_breaking(expect, monkeypatch, tmp_path):
+        path = tmp_path / "image.png"
+        first = utils.leases.Lease(path)
+        first.acquire()
+        mtime = time.time() - 120
+        os.utime(first.lock, (mtime, mtime))
+        rename = os.rename
+        refreshes: list[float] = []
+
+        def refresh_then_rename(source, destination):
+            refreshes.append(mtime + len(refreshes) + 1)  # still old, but refreshed
+            os.utime(first.lock, (refreshes[-1], refreshes[-1]))
+            rename(source, destination)
+
+        monkeypatch.setattr(os, "rename", refresh_then_rename)
+        second = utils.leases.Lease(path, stale=60)
+        expect(second.acquire()) == False
+        expect(first.lock.read_text()) == first.token
+        first.release()
+        expect(list(tmp_path.iterdir())) == []
+
+    def it_keeps_leases_that_are_held_past_stale(expect, tmp_path):
+        path = tmp_path / "image.png"
+        first = utils.leases.Lease(path, stale=0.2)
+        first.acquire()
+        time.sleep(0.5)
+
+        second = utils.leases.Lease(path, stale=0.2)
+        expect(second.acquire()) == False
+        first.release()
+        expect(second.acquire()) == True
+        second.release()
+
+    def it_does_not_block_the_event_loop(expect, monkeypatch, tmp_path):
+        threads = []
+        acquire, release = utils.leases.Lease.acquire, utils.leases.Lease.release
+
+        def record(function):
+            def wrapper(self):
+                threads.append(threading.current_thread())
+                return function(self)
+
+            return wrapper
+
+        monkeypatch.setattr(utils.leases.Lease, "acquire", record(acquire))
+        monkeypatch.setattr(utils.leases.Lease, "release", record(release))
+
+        async def hold():
+            async with utils.leases.Lease(tmp_path / "image.png") as lease:
+                expect(lease.acquired) == True
+
+        asyncio.run(hold())
+
+        expect(len(threads)) == 2
+        expect(threading.current_thread() in threads) == False
+
+    def it_lets_one_process_produce_each_artifact(expect, tmp_path):
+        path = tmp_path / "image.png"
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(4, mp_context=context) as executor:
+            start = time.time() + 3
+            results = list(executor.map(produce, [path] * 4, [start] * 4))
+
+        expect(results.count(True)) == 1
+        expect(path.exists()) == True
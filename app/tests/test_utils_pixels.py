@@ -0,0 +1,108 @@
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from .. import utils
+
+
+def describe_load():
+    def it_maps_dumped_pixels(expect, tmp_path):
+        image = Image.new("RGBA", (3, 2), (1, 2, 3, 4))
+        utils.pixels.dump(image, tmp_path / "image.px", mtime=42)
+
+        loaded = utils.pixels.load(tmp_path / "image.px", mtime=42)
+
+        assert loaded
+        expect(loaded.mode) == "RGBA"
+        expect(loaded.size) == (3, 2)
+        expect(loaded.tobytes()) == image.tobytes()
+
+    def it_survives_concurrent_dumps(expect, tmp_path):
+        image = Image.new("RGB", (64, 64), (1, 2, 3))
+        path = tmp_path / "image.px"
+
+        with ThreadPoolExecutor(8) as executor:
+            for _ in executor.map(lambda _: utils.pixels.dump(image, path), range(32)):
+                pass
+
+        expect(utils.pixels.load(path) is not None) == True
+        expect(list(tmp_path.glob(".*"))) == []
+
+    def it_removes_partial_dumps(expect, monkeypatch, tmp_path):
+        def fill(self):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr(Image.Image, "tobytes", fill)
+
+        with pytest.raises(OSError):
+            utils.pixels.dump(Image.new("RGB", (3, 2)), tmp_path / "image.px")
+
+        expect(list(tmp_path.iterdir())) == []
+
+    def it_rejects_stale_pixels(expect, tmp_path):
+        image = Image.new("RGB", (3, 2))
+        utils.pixels.dump(image, tmp_path / "image.px", mtime=42)
+
+        expect(utils.pixels.load(tmp_path / "image.px", mtime=43)) == None
+
+    def it_rejects_other_files(expect, tmp_path):
+        (tmp_path / "empty.px").touch()
+        (tmp_path / "other.px").write_bytes(b"not pixels" * 10)
+
+        expect(utils.pixels.load(tmp_path / "empty.px")) == None
+        expect(utils.pixels.load(tmp_path / "other.px")) == None
+        expect(utils.pixels.load(tmp_path / "missing.px")) == None
+
+
+def describe_shared():
+    def it_is_visible_to_other_workers(expect, tmp_path):
+        image = Image.new("RGBA", (3, 2), "red")
+        utils.pixels.Shared(tmp_path, 1000).set(tmp_path / "source.png", 1, image)
+
+        shared = utils.pixels.Shared(tmp_path, 1000)
+        loaded = shared.get(tmp_path / "source.png", 1)
+
+        assert loaded
+        expect(loaded.tobytes()) == image.tobytes()
+        expect(shared.stats()["hits"]) == 1
+
+    def it_replaces_stale_versions(expect, tmp_path):
+        shared = utils.pixels.Shared(tmp_path, 1000)
+        shared.set(tmp_path / "source.png", 1, Image.new("RGBA", (3, 2)))
+        shared.set(tmp_path / "source.png", 2, Image.new("RGBA", (3, 2)))
+
+        expect(shared.get(tmp_path / "source.png", 1)) == None
+        expect(shared.stats()["items"]) == 1
+
+    def it_removes_the_oldest_files_when_full(expect, tmp_path):
+        shared = utils.pixels.Shared(tmp_path, 100)
+        shared.set(tmp_path / "a.png", 1, Image.new("RGBA", (4, 4)))
+        shared.set(tmp_path / "b.png", 1, Image.new("RGBA", (4, 4)))
+
+        expect(shared.get(tmp_path / "a.png", 1)) == None
+        expect(shared.get(tmp_path / "b.png", 1)) != None
+        expect(shared.stats()["evictions"]) == 1
+
+    def it_stays_within_the_space_left(expect, monkeypatch, tmp_path):
+        space = utils.pixels.HEADER.size + 4 * 4 * 4  # room for one more file
+        stat = os.statvfs_result((1, 1, space, space, space, 0, 0, 0, 0, 255))
+        monkeypatch.setattr(os, "statvfs", lambda path: stat)
+        shared = utils.pixels.Shared(tmp_path, 1024**2)
+        shared.set(tmp_path / "a.png", 1, Image.new("RGBA", (4, 4)))
+        shared.set(tmp_path / "b.png", 1, Image.new("RGBA", (4, 4)))
+
+        expect(shared.get(tmp_path / "a.png", 1)) == None
+        expect(shared.get(tmp_path / "b.png", 1)) != None
+
+    def it_keeps_variants_of_one_source_apart(expect, tmp_path):
+        shared = utils.pixels.Shared(tmp_path, 1000)
+        shared.set(tmp_path / "source.png", 1, Image.new("RGBA", (3, 2)), "small")
+        shared.set(tmp_path / "source.png", 1, Image.new("RGBA", (6, 4)), "large")
+
+        small = shared.get(tmp_path / "source.png", 1, "small")
+        assert small
+        expect(small.size) == (3, 2)
+        expect(shared.stats()["items"]) == 2
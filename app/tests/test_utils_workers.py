@@ -0,0 +1,69 @@
+import asyncio
+import pickle
+import time
+from multiprocessing.reduction import ForkingPickler
+
+import pytest
+from sanic.exceptions import ServiceUnavailable
+
+from .. import models, utils
+
+
+@pytest.fixture
+def template():
+    return models.Template.objects.get("fry")
+
+
+def describe_workers():
+    def it_renders_in_threads(expect, template):
+        workers = utils.workers.Workers("thread", 0)
+        data = asyncio.run(workers.run(utils.images.encode, template, ["a", "b"]))
+
+        expect(data == utils.images.encode(template, ["a", "b"])) == True
+        expect(workers.stats()["completed"]) == 1
+
+    def it_renders_in_processes(expect, template):
+        workers = utils.workers.Workers("process", 1)
+        try:
+            data = asyncio.run(workers.run(utils.images.encode, template, ["a", "b"]))
+        finally:
+            workers.shutdown()
+
+        expect(data == utils.images.encode(template, ["a", "b"])) == True
+
+    def it_counts_failed_renders_separately(expect):
+        workers = utils.workers.Workers("thread", 0)
+
+        with pytest.raises(ValueError):
+            asyncio.run(workers.run(int, "not a number"))
+
+        expect(workers.stats()["completed"]) == 0
+        expect(workers.stats()["failed"]) == 1
+
+    def it_rejects_renders_beyond_the_queue_size(expect):
+        workers = utils.workers.Workers("thread", 0, queue_size=1)
+
+        async def render():
+            return await asyncio.gather(
+                workers.run(time.sleep, 0.1),
+                workers.run(time.sleep, 0.1),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(render())
+
+        expect(results[0]) == None
+        expect(type(results[1])) == ServiceUnavailable
+        expect(workers.stats()["rejected"]) == 1
+
+
+def describe_reduce_template():
+    def it_sends_plain_templates_to_processes(expect, template):
+        clone = pickle.loads(ForkingPickler.dumps(template))
+
+        expect(clone.id) == template.id
+        expect(clone.text) == list(template.text)
+        expect(clone.image) == template.image
+        expect(clone.build_path(["a"], "", "", (0, 0), "", "png")) == (
+            template.build_path(["a"], "", "", (0, 0), "", "png")
+        )
@@ -1,9 +1,14 @@
+import asyncio
 import json
+import shutil
+import time
 from unittest.mock import AsyncMock, patch
 
 import pytest
+from PIL import features
 
-from .. import settings
+from .. import models, settings, utils, views
+from ..main import app
 
 
 def describe_list():
@@ -173,6 +178,154 @@ def describe_detail(expect, client):
         expect(response.status) == 200
         expect(response.headers["content-type"]) == content_type
 
+    @pytest.mark.parametrize(
+        ("accept", "content_type"),
+        [
+            ("image/avif,image/webp,*/*", "image/webp"),
+            ("image/webp,*/*", "image/webp"),
+            ("*/*", "image/jpeg"),
+            ("", "image/jpeg"),
+        ],
+    )
+    def it_negotiates_automatic_extensions(accept, content_type):
+        headers = {"Accept": accept}
+        request, response = client.get("/images/fry/test.auto", headers=headers)
+        expect(response.status) == 200
+        expect(response.headers["content-type"]) == content_type
+        expect(response.headers["vary"]) == "Accept"
+
+    def it_negotiates_avif_when_enabled(monkeypatch):
+        monkeypatch.setattr(settings, "NEGOTIATED_EXTENSIONS", ["avif", "webp", "jpg"])
+        headers = {"Accept": "image/avif,image/webp,*/*"}
+        request, response = client.get("/images/fry/test.auto", headers=headers)
+        expect(response.status) == 200
+        if features.check("avif"):
+            expect(response.headers["content-type"]) == "image/avif"
+        else:
+            expect(response.headers["content-type"]) == "image/webp"
+
+    def it_negotiates_any_configured_extension(monkeypatch):
+        monkeypatch.setattr(settings, "NEGOTIATED_EXTENSIONS", ["png", "jpg"])
+        headers = {"Accept": "image/png,*/*"}
+        request, response = client.get("/images/fry/test.auto", headers=headers)
+        expect(response.status) == 200
+        expect(response.headers["content-type"]) == "image/png"
+
+    def describe_caching():
+        def it_sends_immutable_cache_headers():
+            request, response = client.get("/images/fry/test.png")
+            expect(response.status) == 200
+            expect(response.headers["etag"]).startswith('"')
+            expect(response.headers["cache-control"]).contains("immutable")
+
+        def it_returns_not_modified_without_rendering(monkeypatch):
+            request, response = client.get("/images/fry/test.png")
+            etag = response.headers["etag"]
+
+            def encode(*args, **kwargs):
+                raise AssertionError("rendered")
+
+            monkeypatch.setattr(utils.images, "encode", encode)
+            headers = {"If-None-Match": f'W/"other", {etag}'}
+            request, response = client.get("/images/fry/test.png", headers=headers)
+            expect(response.status) == 304
+            expect(response.headers["etag"]) == etag
+            expect(response.body) == b""
+
+        def it_varies_by_request():
+            request, response = client.get("/images/fry/test.png")
+            etag = response.headers["etag"]
+            request, response = client.get("/images/fry/test.png?width=500")
+            expect(response.headers["etag"]) != etag
+            request, response = client.get("/images/fry/test.jpg")
+            expect(response.headers["etag"]) != etag
+
+        def it_varies_by_layout_version(monkeypatch):
+            request, response = client.get("/images/fry/test.png")
+            etag = response.headers["etag"]
+            monkeypatch.setattr(utils.images.LAYOUTS, "version", "other")
+            request, response = client.get("/images/fry/test.png")
+            expect(response.headers["etag"]) != etag
+
+        def it_varies_by_template_files(monkeypatch, tmp_path):
+            template = models.Template.objects.get("fry")
+            path = utils.images.get_path(template, ["test"])
+            etag = views.helpers.get_etag(template, path)
+            directory = tmp_path / "fry"
+            shutil.copytree(template.directory, directory)
+            (directory / "default.png").write_bytes(b"changed")
+            monkeypatch.setitem(template.__dict__, "directory", directory)
+            expect(views.helpers.get_etag(template, path)) != etag
+
+        def it_skips_downloaded_backgrounds(monkeypatch):
+            template = models.Template.objects.get("fry")
+            monkeypatch.setattr(
+                models.Template, "create", AsyncMock(return_value=template)
+            )
+            url = "/images/custom/test.png?background=https://example.com/fry.png"
+            request, response = client.get(url)
+            expect(response.status) == 200
+            expect(response.headers).excludes("etag")
+            expect(response.headers.get("cache-control", "")).excludes("immutable")
+
+        def it_skips_errors():
+            request, response = client.get("/images/fry/test.png?width=1")
+            expect(response.status) == 422
+            expect(response.headers).excludes("etag")
+            expect(response.headers.get("cache-control", "")).excludes("immutable")
+
+    def describe_admission():
+        @pytest.fixture(autouse=True)
+        def images(tmp_path, monkeypatch):
+            monkeypatch.setattr(settings, "IMAGES_DIRECTORY", tmp_path)
+            sketch = utils.cache.Sketch(tmp_path / "_admission.bin")
+            monkeypatch.setattr(utils.images, "ADMISSION", sketch)
+
+        def it_serves_one_off_images_from_memory(tmp_path):
+            request, response = client.get("/images/fry/memory.png")
+            expect(response.status) == 200
+            expect(response.headers["content-type"]) == "image/png"
+            expect(list(tmp_path.glob("fry/*/*/memory.*.png"))) == []
+
+        def it_saves_images_requested_again(tmp_path):
+            client.get("/images/fry/memory.png")
+            request, response = client.get("/images/fry/memory.png")
+
+            paths = list(tmp_path.glob("fry/*/*/memory.*.png"))
+            expect(len(paths)) == 1
+            expect(paths[0].read_bytes() == response.body) == True
+
+        def it_frees_the_lease_when_admission_fails(tmp_path, monkeypatch):
+            def admit(key, threshold):
+                raise OSError("Unable to lock")
+
+            monkeypatch.setattr(utils.images.ADMISSION, "admit", admit)
+            request, response = client.get("/images/fry/memory.png")
+            expect(response.status) == 500
+            expect(list(tmp_path.rglob(".*.lease"))) == []
+
+    def it_renders_concurrent_identical_requests_once(tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "IMAGES_DIRECTORY", tmp_path)
+        encode = utils.images.encode
+        renders = []
+
+        def slow_encode(*args, **kwargs):
+            renders.append(args)
+            time.sleep(0.2)
+            return encode(*args, **kwargs)
+
+        monkeypatch.setattr(utils.images, "encode", slow_encode)
+
+        async def fetch():
+            requests = [app.asgi_client.get("/images/fry/viral.png") for _ in range(10)]
+            return await asyncio.gather(*requests)
+
+        responses = [response for _request, response in asyncio.run(fetch())]
+
+        expect(len(renders)) == 1
+        expect({response.status for response in responses}) == {200}
+        expect(len({response.body for response in responses})) == 1
+
     def it_handles_placeholder_templates():
         request, response = client.get("/images/string/test.png")
         expect(response.status) == 200
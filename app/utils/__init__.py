@@ -1 +1,15 @@
-from . import html, http, images, meta, text, urls
+from . import (
+    cache,
+    emojis,
+    frames,
+    glyphs,
+    html,
+    http,
+    images,
+    leases,
+    meta,
+    pixels,
+    text,
+    urls,
+    workers,
+)
@@ -0,0 +1,576 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import socket
+import sqlite3
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager, suppress
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterator
+
+from sanic.log import logger
+
+from . import leases
+
+
+def _close(connections: list[sqlite3.Connection]):
+    while connections:
+        connections.pop().close()
+
+
+class Cache:
+    """Thread-safe LRU bounded by item count or by the total weight of items."""
+
+    def __init__(self, maxsize: int, *, weigh: Callable[[Any], int] | None = None):
+        self.maxsize = maxsize
+        self.weigh = weigh or (lambda value: 1)
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        weight = self.weigh(value)
+        if weight > self.maxsize:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self.weigh(self._items.pop(key))
+            self._items[key] = value
+            self.size += weight
+            while self.size > self.maxsize:
+                _key, evicted = self._items.popitem(last=False)
+                self.size -= self.weigh(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "items": len(self._items),
+            "size": self.size,
+            "maxsize": self.maxsize,
+        }
+
+
+class Store:
+    """JSON key-value store in SQLite behind an in-memory LRU.
+
+    The table is capped at 'maxrows', dropping the least recently used rows
+    after every tenth of that many writes. Rows written under another
+    'version' are dropped when the table is opened.
+    """
+
+    def __init__(
+        self, path: Path, name: str, *, maxsize: int, maxrows: int, version: str = ""
+    ):
+        self.path = path
+        self.name = name
+        self.version = version
+        self.maxrows = maxrows
+        self.memory = Cache(maxsize)
+        self.hits = self.evictions = 0
+        self._writes = 0
+        self._accessed: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        weakref.finalize(self, _close, self._connections)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=1, isolation_level=None, check_same_thread=False
+            )
+            with self._lock:
+                self._connections.append(connection)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")  # no fsync per write
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.name} (key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, version TEXT NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.name}_accessed "
+                f"ON {self.name} (accessed)"
+            )
+            connection.execute(
+                f"DELETE FROM {self.name} WHERE version != ?", (self.version,)
+            )
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Close every thread's connection; threads reopen them on next use."""
+        with self._lock:
+            self._local = threading.local()
+            _close(self._connections)
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self._accessed[key] = time.time()
+            return value
+
+        try:
+            row = self.connection.execute(
+                f"SELECT value FROM {self.name} WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Unable to read {self.name} cache: {e}")
+            return None
+        if row is None:
+            return None
+
+        self.hits += 1
+        value = json.loads(row[0])
+        self.memory.set(key, value)
+        with self._lock:
+            self._accessed[key] = time.time()
+        return value
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        try:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {self.name} VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), self.version, time.time()),
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Unable to write {self.name} cache: {e}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            due = self._writes >= max(1, self.maxrows // 10)
+            if due:
+                self._writes = 0
+        if due:
+            try:
+                self.prune()
+            except sqlite3.Error as e:
+                logger.warning(f"Unable to prune {self.name} cache: {e}")
+
+    def prune(self) -> int:
+        """Record buffered accesses and drop the coldest rows beyond 'maxrows'."""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        with self.connection as connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                f"UPDATE {self.name} SET accessed = ? WHERE key = ?",
+                [(timestamp, key) for key, timestamp in accessed.items()],
+            )
+            count = connection.execute(
+                f"DELETE FROM {self.name} WHERE key IN (SELECT key FROM {self.name} "
+                "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.maxrows,),
+            ).rowcount
+        self.evictions += count
+        return count
+
+    def memoize(self, function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args):
+            key = json.dumps([self.version, function.__name__, *args])
+            value = self.get(key)
+            if value is None:
+                value = json.loads(json.dumps(function(*args)))
+                self.set(key, value)
+            return value
+
+        return wrapper
+
+    def stats(self) -> dict:
+        return {
+            **self.memory.stats(),
+            "disk_hits": self.hits,
+            "disk_evictions": self.evictions,
+        }
+
+
+class Files:
+    """Byte budget for rendered files, evicting the least recently used.
+
+    An SQLite index records each file's size and last access so eviction
+    doesn't walk the directory. Files in 'exclude' and names starting with
+    "." are never indexed, nor are files at the top level such as databases.
+
+    The directory may be shared between nodes, but the index must be local
+    to one. Only the process holding a lease on the directory evicts files
+    or removes rows: it indexes the whole directory when elected and every
+    'rescan' seconds after, picking up files that other nodes wrote. Other
+    processes on its node only add rows for the files they write, and those
+    on other nodes keep none, as nothing there would remove them. Every
+    process records accesses as the files' access times, buffered in memory
+    until each maintenance pass, and the evictor checks them before removing
+    a file.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        maxsize: int,
+        exclude: set[Path] | None = None,
+        index: Path | None = None,
+        rescan: float = 3600,
+    ):
+        self.directory = directory
+        self.path = index or directory / "_files.db"
+        self.maxsize = maxsize
+        self.exclude = exclude or set()
+        self.rescan = rescan
+        self.lease = leases.Lease(directory / "_eviction")
+        self.hits = self.misses = self.evictions = 0
+        self.scanned: float | None = None
+        self.indexing = True
+        self._accessed: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        weakref.finalize(self, _close, self._connections)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            with self._lock:
+                self._connections.append(connection)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Close every thread's connection; threads reopen them on next use."""
+        with self._lock:
+            self._local = threading.local()
+            _close(self._connections)
+
+    def add(self, path: Path):
+        key = self._get_key(path)
+        if key is None:
+            return
+        self.misses += 1
+        if not (self.indexing or self.lease.acquired):
+            return
+        try:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (key, path.stat().st_size, time.time()),
+            )
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Unable to index {path}: {e}")
+
+    def touch(self, path: Path):
+        key = self._get_key(path)
+        if key is None:
+            return
+        self.hits += 1
+        with self._lock:
+            self._accessed[key] = time.time()
+
+    def flush(self):
+        """Record buffered accesses where every node's evictor can see them."""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        for key, timestamp in accessed.items():
+            path = self.directory / key
+            try:
+                mtime = path.stat().st_mtime_ns
+                os.utime(path, ns=(int(timestamp * 1e9), mtime))
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Unable to record access to {path}: {e}")
+
+    def evict(self, *, ratio: float = 0.9, batch: int = 1000) -> int:
+        """Remove the coldest files once over budget, down to 'ratio' of it."""
+        if self.scanned is None or time.monotonic() - self.scanned > self.rescan:
+            self.scan()
+        self.flush()
+
+        size = self.size
+        if size <= self.maxsize:
+            return 0
+
+        removed = []
+        accessed = []
+        offset = 0
+        while size > self.maxsize * ratio:
+            rows = self.connection.execute(
+                "SELECT path, size, accessed FROM files ORDER BY accessed "
+                "LIMIT ? OFFSET ?",
+                (batch, offset),
+            ).fetchall()
+            if not rows:
+                break
+            offset += len(rows)
+            for key, file_size, timestamp in rows:
+                if size <= self.maxsize * ratio:
+                    break
+                path = self.directory / key
+                try:
+                    atime = path.stat().st_atime
+                except FileNotFoundError:
+                    atime = 0.0
+                if atime > timestamp:  # read since indexed, possibly on another node
+                    accessed.append((atime, key))
+                    continue
+                path.unlink(missing_ok=True)
+                removed.append((key,))
+                size -= file_size
+
+        with self.connection as connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "UPDATE files SET accessed = ? WHERE path = ?", accessed
+            )
+            connection.executemany("DELETE FROM files WHERE path = ?", removed)
+
+        self.evictions += len(removed)
+        logger.info(f"Evicted {len(removed)} file(s) from {self.directory}")
+        return len(removed)
+
+    def scan(self):
+        """Index files written elsewhere or earlier and drop deleted ones."""
+        indexed = {key for (key,) in self.connection.execute("SELECT path FROM files")}
+        found = set()
+        rows = []
+        for path in self._walk():
+            key = self._get_key(path)
+            if key is None:
+                continue
+            found.add(key)
+            if key not in indexed:
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                rows.append((key, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+        with self.connection as connection:
+            connection.execute("BEGIN")
+            connection.executemany("INSERT OR IGNORE INTO files VALUES (?, ?, ?)", rows)
+            connection.executemany(
+                "DELETE FROM files WHERE path = ?", [(key,) for key in indexed - found]
+            )
+        self.scanned = time.monotonic()
+
+    def check(self) -> int:
+        """Evict files if this process is elected, else only record accesses."""
+        if not self.lease.acquired and self.lease.acquire():
+            logger.info(f"Elected to evict files from {self.directory}")
+            self.scanned = None
+        if not self.lease.acquired:
+            self.flush()
+            self.indexing = self.lease.owner.split(":")[0] == socket.gethostname()
+            if not self.indexing:
+                # The evictor rebuilds its index when elected, so drop stale rows
+                self.connection.execute("DELETE FROM files")
+            return 0
+        return self.evict()
+
+    async def maintain(self, interval: float):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await asyncio.to_thread(self.check)
+                except (OSError, sqlite3.Error) as e:
+                    logger.error(f"Unable to evict files from {self.directory}: {e}")
+        finally:
+            self.lease.release()
+
+    @property
+    def size(self) -> int:
+        return self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM files"
+        ).fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        items = size = None
+        if self.indexing or self.lease.acquired:
+            with suppress(sqlite3.Error):
+                items, size = self.connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files"
+                ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "items": items,
+            "size": size,
+            "maxsize": self.maxsize,
+        }
+
+    def _walk(self) -> Iterator[Path]:
+        if not self.directory.is_dir():
+            return
+        for top in self.directory.iterdir():
+            if not top.is_dir() or top in self.exclude or top.name.startswith("."):
+                continue
+            for root, directories, filenames in os.walk(top):
+                directories[:] = [name for name in directories if name[0] != "."]
+                for filename in filenames:
+                    yield Path(root) / filename
+
+    def _get_key(self, path: Path) -> str | None:
+        try:
+            relative = path.relative_to(self.directory)
+        except ValueError:
+            return None
+        if len(relative.parts) < 2 or any(
+            part.startswith(".") for part in relative.parts
+        ):
+            return None
+        if self.directory / relative.parts[0] in self.exclude:
+            return None
+        return relative.as_posix()
+
+
+class Sketch:
+    """Count-min sketch of recent key frequencies for cache admission.
+
+    Counters live in a memory-mapped file so every worker on a node counts
+    into the same table. Updates hold an exclusive lock on the file, as
+    halving races with increments otherwise. The file must be local to the
+    node: mapped writes are not coherent across a network filesystem. After
+    'sample' additions all counters are halved so that old popularity fades
+    (as in TinyLFU).
+    """
+
+    HEADER = struct.Struct("<Q")
+    HALVE = bytes(value // 2 for value in range(256))
+
+    def __init__(self, path: Path, *, width: int = 2**16, depth: int = 4):
+        self.path = path
+        self.width = width
+        self.depth = depth
+        self.sample = width * 10
+        self.admitted = self.rejected = 0
+        self._buffer: mmap.mmap | None = None
+        self._descriptor = -1
+        self._lock = threading.Lock()
+
+    @property
+    def buffer(self) -> mmap.mmap:
+        if self._buffer is None:
+            size = self.HEADER.size + self.width * self.depth
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._locked(descriptor):
+                if os.fstat(descriptor).st_size != size:
+                    os.ftruncate(descriptor, size)
+            self._buffer = mmap.mmap(descriptor, size)
+            self._descriptor = descriptor
+        return self._buffer
+
+    @staticmethod
+    @contextmanager
+    def _locked(descriptor: int) -> Iterator[None]:
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(descriptor, fcntl.LOCK_UN)
+
+    def add(self, key: str) -> int:
+        """Count an occurrence of 'key' and return its estimated frequency."""
+        with self._lock:
+            buffer = self.buffer
+            with self._locked(self._descriptor):
+                estimate = 255
+                for index in self._get_indexes(key):
+                    buffer[index] = min(buffer[index] + 1, 255)
+                    estimate = min(estimate, buffer[index])
+
+                (additions,) = self.HEADER.unpack_from(buffer)
+                if additions + 1 >= self.sample:
+                    counters = buffer[self.HEADER.size :]
+                    buffer[self.HEADER.size :] = counters.translate(self.HALVE)
+                    additions = 0
+                self.HEADER.pack_into(buffer, 0, additions + 1)
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        buffer = self.buffer
+        return min(buffer[index] for index in self._get_indexes(key))
+
+    def admit(self, key: str, threshold: int) -> bool:
+        """Count 'key' and decide whether it has been seen often enough to keep."""
+        try:
+            frequency = self.add(key)
+        except OSError as e:
+            logger.warning(f"Unable to count {key}: {e}")
+            frequency = threshold
+        if frequency >= threshold:
+            self.admitted += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def stats(self) -> dict:
+        total = self.admitted + self.rejected
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "admission_rate": round(self.admitted / total, 3) if total else 0.0,
+            "size": self.HEADER.size + self.width * self.depth,
+        }
+
+    def _get_indexes(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=8 * self.depth).digest()
+        return [
+            self.HEADER.size
+            + row * self.width
+            + int.from_bytes(digest[row * 8 : row * 8 + 8], "little") % self.width
+            for row in range(self.depth)
+        ]
@@ -0,0 +1,122 @@
+import io
+import json
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+from PIL import Image
+from pilmoji.source import BaseSource, Twemoji
+from sanic.log import logger
+
+from .. import settings
+from ..types import ImageType
+from . import cache, pixels
+
+SIZE = 72  # Twemoji's native resolution
+
+
+class Atlas(BaseSource):
+    """Pilmoji source that reads emoji from a bundled, memory-mapped atlas.
+
+    The atlas is a vertical strip of SIZE×SIZE cells written by build() so
+    each emoji occupies contiguous pages. Emoji missing from the atlas are
+    drawn as text rather than fetched, keeping rendering off the network.
+    Without an atlas, as in a checkout that has not run 'make compile',
+    emoji are requested from the 'fallback' source instead, and requested
+    again next time if that fails. Deployed servers refuse to start without
+    one, as every build step (Containerfile, bin/post_compile) creates it.
+    """
+
+    def __init__(
+        self, path: Path, *, fallback: BaseSource | None = None, maxsize: int = 1024
+    ):
+        self.path = path
+        self.fallback = fallback
+        self.streams = cache.Cache(maxsize)
+        self._image: ImageType | None = None
+        self._index: dict[str, int] | None = None
+        self._lock = threading.Lock()
+
+    def get_emoji(self, emoji: str, /) -> io.BytesIO | None:
+        data = self.streams.get(emoji)
+        if data is None:
+            image, index = self._load()
+            if image is None and self.fallback:
+                data = fetch(self.fallback, emoji)
+                if data:  # so failed downloads are retried
+                    self.streams.set(emoji, data)
+            else:
+                data = self._crop(image, index, emoji)
+                self.streams.set(emoji, data)
+        return io.BytesIO(data) if data else None
+
+    def get_discord_emoji(self, id: int, /) -> io.BytesIO | None:
+        return None
+
+    @property
+    def available(self) -> bool:
+        image, _index = self._load()
+        return image is not None
+
+    def stats(self) -> dict:
+        return self.streams.stats()
+
+    def _crop(
+        self, image: ImageType | None, index: dict[str, int], emoji: str
+    ) -> bytes:
+        row = index.get(emoji, index.get(emoji.replace("\ufe0f", "")))
+        if image is None or row is None:
+            return b""
+        cell = image.crop((0, row * SIZE, SIZE, (row + 1) * SIZE))
+        stream = io.BytesIO()
+        cell.save(stream, format="TGA")  # uncompressed, so reopening is cheap
+        return stream.getvalue()
+
+    def _load(self) -> tuple[ImageType | None, dict[str, int]]:
+        with self._lock:
+            if self._index is None:
+                self._image = pixels.load(self.path.with_suffix(".px"))
+                try:
+                    self._index = json.loads(self.path.with_suffix(".json").read_text())
+                except (FileNotFoundError, json.JSONDecodeError):
+                    self._index = {}
+                if self._image is None or not self._index:
+                    self._image = None
+                    fallback = "downloading" if self.fallback else "drawing as text"
+                    logger.warning(f"No emoji atlas at {self.path}, {fallback}")
+            return self._image, self._index
+
+
+def fetch(source: BaseSource, emoji: str) -> bytes:
+    """Image data for an emoji from another source, or empty when unavailable."""
+    try:
+        stream = source.get_emoji(emoji)
+    except OSError as e:  # including HTTP and connection errors
+        logger.warning(f"Unable to fetch emoji {emoji}: {e}")
+        return b""
+    # Some sources wrap a failed response as BytesIO(None)
+    return stream.getvalue() if stream else b""
+
+
+def build(images: Iterable[tuple[str, ImageType]], path: Path) -> int:
+    """Write an atlas of the given emoji images and return the count."""
+    cells: list[ImageType] = []
+    index: dict[str, int] = {}
+    for emoji, image in images:
+        index[emoji] = len(cells)
+        index.setdefault(emoji.replace("\ufe0f", ""), len(cells))
+        cell = image.convert("RGBA")
+        if cell.size != (SIZE, SIZE):
+            cell = cell.resize((SIZE, SIZE), Image.Resampling.LANCZOS)
+        cells.append(cell)
+
+    strip = Image.new("RGBA", (SIZE, SIZE * max(len(cells), 1)))
+    for row, cell in enumerate(cells):
+        strip.paste(cell, (0, row * SIZE))
+
+    pixels.dump(strip, path.with_suffix(".px"))
+    path.with_suffix(".json").write_text(json.dumps(index, ensure_ascii=False))
+    return len(cells)
+
+
+ATLAS = Atlas(settings.EMOJI_ATLAS, fallback=Twemoji())
@@ -0,0 +1,151 @@
+import json
+import mmap
+import os
+import tempfile
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image, ImageSequence
+from sanic.log import logger
+
+from .. import settings
+from ..types import Dimensions, ImageType
+from . import cache, text
+
+VERSION = 1
+FILES = cache.Files(settings.FRAMES_DIRECTORY, maxsize=settings.FRAMES_DIRECTORY_SIZE)
+
+
+@dataclass
+class Animation:
+    size: Dimensions
+    durations: list[int]
+    buffer: mmap.mmap
+
+    def __len__(self) -> int:
+        return len(self.durations)
+
+    def __iter__(self) -> Iterator[ImageType]:
+        width, height = self.size
+        length = width * height * 4
+        view = memoryview(self.buffer)
+        for index in range(len(self)):
+            data = view[index * length : (index + 1) * length]
+            yield Image.frombuffer(
+                "RGBA", self.size, data, "raw", "RGBA", 0, 1  # type: ignore[arg-type]
+            )
+
+    @property
+    def duration(self) -> int:
+        return self.durations[0]
+
+
+@dataclass
+class Sequence:
+    image: ImageType
+
+    def __len__(self) -> int:
+        return getattr(self.image, "n_frames", 1)
+
+    def __iter__(self) -> Iterator[ImageType]:
+        for frame, _duration in decode(self.image):
+            yield frame
+
+    @property
+    def duration(self) -> int:
+        return self.image.info.get("duration", 100)
+
+
+def get_directory(path: Path) -> Path:
+    return settings.FRAMES_DIRECTORY / text.fingerprint(str(path.resolve()), prefix="")
+
+
+def load(path: Path) -> Animation | None:
+    """Decoded frames of an animated image, or None for a single frame."""
+    directory = get_directory(path)
+    mtime = path.stat().st_mtime_ns
+
+    index = _read_index(directory)
+    if index.get("version") != VERSION or index.get("mtime") != mtime:
+        index = build(path, directory, mtime)
+    if index["count"] < 2:
+        return None
+
+    try:
+        file = (directory / index["filename"]).open("rb")
+    except FileNotFoundError:  # evicted since the index was written
+        index = build(path, directory, mtime)
+        file = (directory / index["filename"]).open("rb")
+    with file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    FILES.touch(Path(file.name))
+    return Animation(tuple(index["size"]), index["durations"], buffer)
+
+
+def stream(path: Path) -> Sequence | None:
+    """Frames of an animated image decoded on demand, without storing them."""
+    image = Image.open(path)
+    if getattr(image, "n_frames", 1) < 2:
+        return None
+    return Sequence(image)
+
+
+def decode(image: ImageType) -> Iterator[tuple[ImageType, int]]:
+    """Yield each frame composited to RGBA with its duration in milliseconds."""
+    default = image.info.get("duration", 100)
+    for frame in ImageSequence.Iterator(image):
+        yield frame.convert("RGBA"), frame.info.get("duration", default)
+
+
+def build(path: Path, directory: Path, mtime: int) -> dict:
+    directory.mkdir(parents=True, exist_ok=True)
+    filename = f"{mtime}.rgba"
+
+    durations = []
+    size = (0, 0)
+    with Image.open(path) as source:
+        if getattr(source, "n_frames", 1) > 1:
+            logger.info(f"Extracting frames from {path}")
+            descriptor, temporary = _create_temporary(directory)
+            with os.fdopen(descriptor, "wb") as file:
+                for frame, duration in decode(source):
+                    file.write(frame.tobytes())
+                    durations.append(duration)
+                    size = frame.size
+            os.replace(temporary, directory / filename)
+            FILES.add(directory / filename)
+
+    index = {
+        "version": VERSION,
+        "source": str(path),
+        "mtime": mtime,
+        "filename": filename,
+        "size": size,
+        "count": len(durations),
+        "durations": durations,
+    }
+    descriptor, temporary = _create_temporary(directory)
+    with os.fdopen(descriptor, "w") as file:
+        file.write(json.dumps(index))
+    os.replace(temporary, directory / "index.json")
+
+    for stale in directory.glob("*.rgba"):
+        if stale.name != filename:
+            stale.unlink(missing_ok=True)
+
+    return index
+
+
+def _create_temporary(directory: Path) -> tuple[int, str]:
+    # Unique per call, as threads building the same frames share a pid
+    descriptor, temporary = tempfile.mkstemp(prefix=".", dir=directory)
+    os.fchmod(descriptor, 0o644)
+    return descriptor, temporary
+
+
+def _read_index(directory: Path) -> dict:
+    try:
+        return json.loads((directory / "index.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
@@ -0,0 +1,128 @@
+import json
+from array import array
+from dataclasses import dataclass
+from functools import cache
+from string import ascii_letters, digits
+
+from PIL import Image, ImageDraw, ImageFont
+from sanic.log import logger
+
+from .. import settings
+
+DIRECTORY = settings.ROOT / "fonts" / "metrics"
+
+SIZE = 1000
+FIRST, LAST = 32, 255
+KERNED = ascii_letters + digits + ".,'!?"
+DESCENDERS = "gjpqy,;()[]{}"
+MISSING = -1
+
+
+@dataclass
+class Table:
+    advances: array
+    kerning: dict[str, int]
+    line_height: int
+    cap_height: int
+    descent: int
+
+    def estimate_width(self, line: str) -> float | None:
+        """Width of a single line at unit size, or None for unknown glyphs."""
+        width = 0
+        for character in line:
+            index = ord(character) - FIRST
+            if not 0 <= index < len(self.advances):
+                return None
+            if self.advances[index] == MISSING:
+                return None
+            width += self.advances[index]
+        for index in range(len(line) - 1):
+            width += self.kerning.get(line[index : index + 2], 0)
+        return width / SIZE
+
+    def estimate_size(self, text: str, max_width: float, max_height: float) -> int:
+        """Largest font size expected to fit, or zero when it cannot be estimated."""
+        widths = [self.estimate_width(line) for line in text.split("\n")]
+        if not widths or None in widths:
+            return 0
+
+        rows = len(widths)
+        width = max(widths)  # type: ignore[type-var]
+        units = (rows - 1) * self.line_height + self.cap_height
+        if any(letter in text.split("\n")[-1] for letter in DESCENDERS):
+            units += self.descent
+        height = units / SIZE
+        spacing = (rows - 1) * 4  # Pillow's default multiline spacing
+        stroke = 3  # the widest stroke drawn around text
+
+        sizes = [(max_height - spacing - stroke * rows) / height]
+        if width:
+            sizes.append((max_width - stroke) / width)
+        return max(0, int(min(sizes)))
+
+
+def build(filename: str) -> dict:
+    path = settings.ROOT / "fonts" / filename
+    font = ImageFont.truetype(str(path), size=SIZE)
+    notdef = _render(font, "\U0010fffd")
+
+    advances = []
+    for codepoint in range(FIRST, LAST + 1):
+        character = chr(codepoint)
+        if not character.isprintable():
+            advances.append(MISSING)
+        elif not character.isspace() and _render(font, character) == notdef:
+            advances.append(MISSING)
+        else:
+            advances.append(round(font.getlength(character)))
+
+    kerning = {}
+    for first in KERNED:
+        for second in KERNED:
+            pair = first + second
+            adjustment = font.getlength(pair)
+            adjustment -= font.getlength(first) + font.getlength(second)
+            if adjustment:
+                kerning[pair] = round(adjustment)
+
+    _ascent, descent = font.getmetrics()
+    _left, top, _right, bottom = font.getbbox("A")
+    return {
+        "filename": filename,
+        "size": SIZE,
+        "first": FIRST,
+        "advances": advances,
+        "kerning": kerning,
+        "line_height": bottom,
+        "cap_height": bottom - top,
+        "descent": descent,
+    }
+
+
+def _render(font: ImageFont.FreeTypeFont, character: str) -> bytes:
+    image = Image.new("L", (SIZE * 2, SIZE * 2))
+    ImageDraw.Draw(image).text((0, 0), character, 255, font)
+    return image.tobytes()
+
+
+@cache
+def load(font_id: str) -> Table | None:
+    path = DIRECTORY / f"{font_id}.json"
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        logger.warning(f"No glyph metrics for font: {font_id}")
+        return None
+
+    return Table(
+        advances=array("i", data["advances"]),
+        kerning=data["kerning"],
+        line_height=data["line_height"],
+        cap_height=data["cap_height"],
+        descent=data["descent"],
+    )
+
+
+def load_all():
+    for path in DIRECTORY.glob("*.json"):
+        load(path.stem)
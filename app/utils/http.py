@@ -1,4 +1,5 @@
 import asyncio
+import uuid
 
 import aiofiles
 import aiohttp
@@ -51,9 +52,16 @@ async def download(url: str, path: AsyncPath) -> bool:
 
                 if response.status == 200:
                     logger.info(f"200 response from {url}")
-                    f = await aiofiles.open(path, mode="wb")  # type: ignore
-                    await f.write(await response.read())
-                    await f.close()
+                    temporary = path.with_name(f".{uuid.uuid4().hex}")
+                    try:
+                        f = await aiofiles.open(temporary, mode="wb")  # type: ignore
+                        try:
+                            await f.write(await response.read())
+                        finally:
+                            await f.close()
+                        await temporary.replace(path)
+                    finally:
+                        await temporary.unlink(missing_ok=True)
                     return True
 
                 logger.error(f"{response.status} response from {url}")
@@ -1,9 +1,16 @@
 from __future__ import annotations
 
+import hashlib
 import io
-from contextlib import contextmanager
+import math
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager, suppress
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterator, cast
+from typing import Callable, Hashable, Iterator, cast
 
 import emoji
 import webp
@@ -12,10 +19,9 @@ from PIL import (
     ImageColor,
     ImageDraw,
     ImageFilter,
-    ImageFont,
     ImageOps,
-    ImageSequence,
     UnidentifiedImageError,
+    features,
 )
 from pilmoji import Pilmoji
 from sanic.log import logger
@@ -23,6 +29,7 @@ from sanic.log import logger
 from .. import settings, utils
 from ..models import Font, Overlay, Template, Text
 from ..types import Align, Dimensions, DrawType, FontType, ImageType, Offset, Point
+from . import cache, emojis, leases, pixels
 
 EXCEPTIONS = (
     OSError,
@@ -31,6 +38,66 @@ EXCEPTIONS = (
     UnidentifiedImageError,
 )
 
+QUALITY = {"avif": 60, "webp": 80}
+
+_measuring = threading.local()
+
+DARKEN = [int(value * 0.4) for value in range(256)]
+BLUR_SCALE = 2
+
+BACKGROUNDS = cache.Cache(
+    settings.BACKGROUND_CACHE_SIZE,
+    weigh=lambda image: image.width * image.height * len(image.getbands()),
+)
+WATERMARKS = cache.Cache(256)
+BLURRED_BACKGROUNDS = cache.Cache(
+    settings.BLURRED_BACKGROUND_CACHE_SIZE,
+    weigh=lambda image: image.width * image.height * len(image.getbands()),
+)
+SHARED_BACKGROUNDS = pixels.Shared(
+    settings.SHARED_BACKGROUNDS_DIRECTORY, settings.SHARED_BACKGROUNDS_SIZE
+)
+RESIZED_BACKGROUNDS = cache.Cache(
+    settings.RESIZED_BACKGROUND_CACHE_SIZE,
+    weigh=lambda image: image.width * image.height * len(image.getbands()),
+)
+SHARED_RESIZED_BACKGROUNDS = pixels.Shared(
+    settings.RESIZED_BACKGROUNDS_DIRECTORY, settings.RESIZED_BACKGROUNDS_SIZE
+)
+
+IMAGES = cache.Files(
+    settings.IMAGES_DIRECTORY,
+    maxsize=settings.IMAGES_DIRECTORY_SIZE,
+    index=settings.CACHE_DIRECTORY / "images.db",
+    rescan=settings.IMAGES_SCAN_INTERVAL,
+)
+ADMISSION = cache.Sketch(settings.CACHE_DIRECTORY / "admission.bin")
+
+
+def _get_layout_version() -> str:
+    """Digest of everything a stored layout depends on besides its arguments."""
+    digest = hashlib.sha1(Path(__file__).read_bytes())
+    for path in sorted((settings.ROOT / "fonts").glob("*.tt[cf]")):
+        digest.update(path.read_bytes())
+    for value in [
+        Image.__version__,
+        features.version("freetype2"),
+        settings.MAXIMUM_LINES,
+        settings.MINIMUM_FONT_SIZE,
+    ]:
+        digest.update(str(value).encode())
+    return digest.hexdigest()
+
+
+LAYOUTS = cache.Store(
+    settings.CACHE_DIRECTORY / "layouts.db",
+    "layouts",
+    maxsize=settings.LAYOUT_CACHE_SIZE,
+    maxrows=settings.LAYOUT_STORE_SIZE,
+    version=_get_layout_version(),
+)
+FINGERPRINT = re.compile(r"\.([0-9a-f]{40})\.")
+
 
 def preview(
     template: Template,
@@ -66,22 +133,67 @@ def save(
     size: Dimensions = (0, 0),
     maximum_frames: int = 0,
     directory: Path = settings.IMAGES_DIRECTORY,
+    animated: bool | None = None,
 ) -> Path:
-    size = fit_image(*size)
-
-    path = directory / template.build_path(
-        lines, font_name, style, size, watermark, extension, maximum_frames
+    path = directory / get_path(
+        template,
+        lines,
+        watermark,
+        font_name=font_name,
+        extension=extension,
+        style=style,
+        size=size,
+        maximum_frames=maximum_frames,
+        animated=animated,
     )
     if path.exists():
         if settings.DEPLOYED:
             logger.info(f"Loading meme from {path}")
+            IMAGES.touch(path)
             return path
         logger.info(f"Rebuilding meme at {path}")
     else:
         logger.info(f"Saving meme to {path}")
-        path.parent.mkdir(parents=True, exist_ok=True)
 
-    if extension == "gif":
+    with leases.Lease(path) as lease:
+        if lease.waited and path.exists():
+            logger.info(f"Loading meme rendered by another process from {path}")
+            return path
+        data = encode(
+            template,
+            lines,
+            watermark,
+            font_name=font_name,
+            extension=extension,
+            style=style,
+            size=size,
+            maximum_frames=maximum_frames,
+            animated=animated,
+        )
+        write(path, data)
+
+    return path
+
+
+def encode(
+    template: Template,
+    lines: list[str],
+    watermark: str = "",
+    *,
+    font_name: str = "",
+    extension: str = settings.DEFAULT_STATIC_EXTENSION,
+    style: str = "default",
+    size: Dimensions = (0, 0),
+    maximum_frames: int = 0,
+    animated: bool | None = None,
+) -> bytes:
+    """Render and encode an image in memory without touching the disk."""
+    size = fit_image(*size)
+    if animated is None:
+        animated = extension in settings.ANIMATED_EXTENSIONS
+
+    stream = io.BytesIO()
+    if animated and extension == "gif":
         frames, duration = render_animation(
             template,
             style,
@@ -91,16 +203,16 @@ def save(
             maximum_frames,
             watermark=watermark,
         )
-        logger.info(f"Saving {len(frames)} frames as GIF at {duration} ms/frame")
+        logger.info(f"Encoding {len(frames)} frames as GIF at {duration} ms/frame")
         frames[0].save(
-            path,
+            stream,
             format=extension,
             save_all=True,
             append_images=frames[1:],
             duration=duration,
             loop=0,
         )
-    elif extension == "webp":
+    elif animated and extension == "webp":
         frames, duration = render_animation(
             template,
             style,
@@ -112,23 +224,175 @@ def save(
         )
         count = len(frames)
         fps = round(1 / duration * 1000, 2)
-        logger.info(f"Saving {count} frames as WebP at {fps} frame/s")
-        webp.save_images(frames, str(path), fps=fps, lossless=False)
+        logger.info(f"Encoding {count} frames as WebP at {fps} frame/s")
+        stream.write(encode_webp(frames, fps))
     else:
         image = render_image(
             template, style, lines, size, font_name, watermark=watermark
         )
-        image.convert("RGB").save(path, quality=95)
+        quality = QUALITY.get(extension, 95)
+        format = Image.registered_extensions()["." + extension]
+        image.convert("RGB").save(stream, format=format, quality=quality)
+
+    return stream.getvalue()
+
+
+def encode_webp(frames: list[ImageType], fps: float) -> bytes:
+    # Same as webp.save_images() but keeps the assembled data in memory
+    pictures = [webp.WebPPicture.from_pil(frame) for frame in frames]
+    options = webp.WebPAnimEncoderOptions.new()
+    encoder = webp.WebPAnimEncoder.new(*frames[0].size, options)
+    config = webp.WebPConfig.new(lossless=False)
+    for index, picture in enumerate(pictures):
+        encoder.encode_frame(picture, round(index * 1000 / fps), config)
+    data = encoder.assemble(round(len(pictures) * 1000 / fps))
+    return bytes(data.buffer())
+
+
+def write(path: Path, data: bytes):
+    """Atomically replace 'path' so readers never see a partial image."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(prefix=".", dir=path.parent)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            os.fchmod(file.fileno(), 0o644)
+            file.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    IMAGES.add(path)
+
+
+def get_path(
+    template: Template,
+    lines: list[str],
+    watermark: str = "",
+    *,
+    font_name: str = "",
+    extension: str = settings.DEFAULT_STATIC_EXTENSION,
+    style: str = "default",
+    size: Dimensions = (0, 0),
+    maximum_frames: int = 0,
+    animated: bool | None = None,
+) -> Path:
+    """Relative path that save() renders to, computed without rendering."""
+    size = fit_image(*size)
+    if animated is None:
+        animated = extension in settings.ANIMATED_EXTENSIONS
 
+    path = template.build_path(
+        lines, font_name, style, size, watermark, extension, maximum_frames
+    )
+    if not animated and extension in settings.ANIMATED_EXTENSIONS:
+        path = path.with_suffix(".static" + path.suffix)
     return path
 
 
+def shard(directory: Path = settings.IMAGES_DIRECTORY) -> int:
+    """Move renders saved in an older layout into their filename shards."""
+    internal = {path.name for path in IMAGES.exclude}
+    count = 0
+    for top in sorted(directory.iterdir()):
+        if not top.is_dir() or top.name in internal or top.name.startswith("."):
+            continue
+        for path in sorted(top.rglob("*")):
+            match = FINGERPRINT.search(path.name)
+            if not match or not path.is_file() or path.name.startswith("."):
+                continue
+            parts = path.relative_to(top).parts
+            if parts[:2] == utils.text.shards(Path(*parts[2:]).as_posix()):
+                continue
+            fingerprint = match.group(1)
+            if len(parts) > 2 and parts[:2] == (fingerprint[:2], fingerprint[2:4]):
+                parts = parts[2:]  # previously sharded by fingerprint alone
+            filename = Path(*parts).as_posix()
+            target = top.joinpath(*utils.text.shards(filename), filename)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+            count += 1
+        for root, _directories, _filenames in os.walk(top, topdown=False):
+            with suppress(OSError):
+                Path(root).rmdir()  # only succeeds once empty
+    return count
+
+
 def load(path: Path) -> ImageType:
+    image = load_compiled(path)
+    if image is None:
+        image = decode(path)
+    return image
+
+
+def decode(path: Path) -> ImageType:
     image = Image.open(path).convert("RGBA")
     image = cast(ImageType, ImageOps.exif_transpose(image))
     return image
 
 
+def load_compiled(path: Path) -> ImageType | None:
+    """Pixels written by compile_image() when they are newer than the source."""
+    compiled_path = get_compiled_path(path)
+    if not compiled_path.exists():
+        return None
+    image = utils.pixels.load(compiled_path, mtime=path.stat().st_mtime_ns)
+    if image and image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return image
+
+
+def compile_image(path: Path) -> Path:
+    compiled_path = get_compiled_path(path)
+    image = decode(path)
+    if image.getchannel("A").getextrema() == (255, 255):
+        image = image.convert("RGB")  # opaque, so a quarter smaller without alpha
+    utils.pixels.dump(image, compiled_path, mtime=path.stat().st_mtime_ns)
+    return compiled_path
+
+
+def get_compiled_path(path: Path) -> Path:
+    # Underscore-prefixed files are not treated as template styles
+    return path.with_name(f"_{path.name}.px")
+
+
+def load_background(path: Path) -> ImageType:
+    """Decoded background shared between renders, so it must not be modified."""
+    mtime = path.stat().st_mtime_ns
+    key = path, mtime
+    image = BACKGROUNDS.get(key)
+    if image is None:
+        image = load_compiled(path)
+        if image is None:
+            image = SHARED_BACKGROUNDS.get(path, mtime)
+        if image is None:
+            image = decode(path)
+            SHARED_BACKGROUNDS.set(path, mtime, image)
+        BACKGROUNDS.set(key, image)
+    return image
+
+
+def load_resized_background(
+    path: Path, width: int, height: int, pad: bool, *, expand: bool
+) -> ImageType:
+    """Resized copy of a background that the caller is free to draw on."""
+    mtime = path.stat().st_mtime_ns
+    key = path, mtime, width, height, pad, expand
+    image = RESIZED_BACKGROUNDS.get(key)
+
+    if image is None:
+        variant = repr(key[2:])
+        if settings.RESIZED_BACKGROUND_PERSISTENCE:
+            image = SHARED_RESIZED_BACKGROUNDS.get(path, mtime, variant)
+        if image is None:
+            background = load_background(path)
+            image = resize_image(background, width, height, pad, expand=expand)
+            if settings.RESIZED_BACKGROUND_PERSISTENCE:
+                SHARED_RESIZED_BACKGROUNDS.set(path, mtime, image, variant)
+        RESIZED_BACKGROUNDS.set(key, image)
+
+    return image.copy()
+
+
 def embed_foreground_path(template: Template, url: str) -> Path:
     """Filesystem path for a downloaded overlay image (same fingerprint as Template._embed)."""
     url = url.strip()
@@ -203,15 +467,11 @@ def merge(template: Template, index: int, foreground_path: Path, background_path
         logger.debug(f"Skipping merge bake for timed overlay index={index}")
         return
 
-    background = Image.open(background_path)
     foreground_master = load(foreground_path)
 
     frames = []
-    for frame in ImageSequence.Iterator(background):
-        stream = io.BytesIO()
-        frame.save(stream, format="GIF")
-        background = Image.open(stream).convert("RGBA")  # type: ignore[assignment]
-
+    durations = []
+    for background, duration in utils.frames.decode(Image.open(background_path)):
         chip = foreground_master.copy()
         size = overlay.get_size(background.size)
         chip.thumbnail(size)
@@ -221,9 +481,15 @@ def merge(template: Template, index: int, foreground_path: Path, background_path
         background.paste(chip, (x1, y1), mask=chip.convert("RGBA"))
 
         frames.append(background)
+        durations.append(duration)
 
     logger.debug(f"Merging {len(frames)} frame(s) for custom GIF background")
-    frames[0].save(background_path, save_all=True, append_images=frames[1:])
+    frames[0].save(
+        background_path,
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+    )
 
 
 def pad_top(source_path: Path, destination_path: Path):
@@ -235,20 +501,19 @@ def pad_top(source_path: Path, destination_path: Path):
 
     if source_path.suffix == ".gif":
         frames = []
-        for frame in ImageSequence.Iterator(foreground):
-            stream = io.BytesIO()
-            frame.save(stream, format="GIF")
-
+        durations = []
+        for frame, duration in utils.frames.decode(foreground):
             background = Image.new("RGBA", background_dimensions, "white")
-            background.paste(foreground, (0, extra))
+            background.paste(frame, (0, extra))
             frames.append(background)
+            durations.append(duration)
 
         logger.debug(f"Padding {len(frames)} frame(s) for custom background")
         frames[0].save(
             destination_path,
             save_all=True,
             append_images=frames[1:],
-            duration=foreground.info.get("duration", 100),
+            duration=durations,
             loop=0,
         )
     else:
@@ -268,10 +533,10 @@ def render_image(
     is_preview: bool = False,
     watermark: str = "",
 ) -> ImageType:
-    background = load(template.get_image(style))
+    background_path = template.get_image(style)
 
     pad = all(size) if pad is None else pad
-    image = resize_image(background, *size, pad, expand=True)
+    image = load_resized_background(background_path, *size, pad, expand=True)
     if any(
         (
             size[0] and size[0] <= settings.PREVIEW_SIZE[0],
@@ -298,43 +563,11 @@ def render_image(
             continue
         composite_overlay_frame(image, overlay, foreground)
 
-    for (
-        point,
-        offset,
-        text,
-        max_text_size,
-        text_fill,
-        font,
-        align,
-        stroke_width,
-        stroke_fill,
-        angle,
-    ) in get_image_elements(
+    for element in get_image_elements(
         template, lines, font_name, watermark, image.size, is_preview
     ):
-        box = Image.new("RGBA", max_text_size)
-        draw = ImageDraw.Draw(box)
-
-        if settings.DEBUG:
-            xy = (0, 0, max_text_size[0] - 1, max_text_size[1] - 1)
-            outline = "orange" if text == settings.PREVIEW_TEXT else "lime"
-            draw.rectangle(xy, outline=outline)
-
-        rows = text.count("\n") + 1
-        with emoji_support(box, draw, text) as draw:
-            draw.text(
-                (-offset[0], -offset[1]),
-                text,
-                text_fill,
-                font,
-                spacing=-offset[1] / (rows * 2),
-                align=align,
-                stroke_width=stroke_width,
-                stroke_fill=stroke_fill,
-            )
-
-        box = box.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True)
-        image.paste(box, point, box)
+        box = render_text_box(*element[1:])
+        image.paste(box, element[0], box)
 
     if settings.DEBUG:
         for overlay in template.overlay:
@@ -359,7 +592,9 @@ def render_image(
             image.paste(box, point, mask=box)
 
     if pad:
-        image = add_blurred_background(image, background, *size)
+        background = load_background(background_path)
+        key = background_path, background_path.stat().st_mtime_ns
+        image = add_blurred_background(image, background, *size, key)
 
     if watermark:
         image = add_watermark(image, watermark, is_preview)
@@ -380,13 +615,27 @@ def render_animation(
     watermark: str = "",
 ) -> tuple[list[ImageType], int]:
     frames = []
+    animation: utils.frames.Animation | utils.frames.Sequence | None
 
     pad = all(size) if pad is None else pad
-    source = Image.open(template.get_image(style, animated=True))
+    source_path = template.get_image(style, animated=True)
+    if any(
+        (
+            template.id.startswith("_custom"),
+            source_path.stem.startswith("_custom"),
+            utils.urls.schema(style),
+        )
+    ):
+        # Any client can supply a background, so only store template frames
+        animation = utils.frames.stream(source_path)
+    else:
+        animation = utils.frames.load(source_path)
+    source = Image.open(source_path)
     duration = source.info.get("duration", 100)
-    total = getattr(source, "n_frames", 1)
-    if total > 1:
-        sources = ImageSequence.Iterator(source)
+    if animation:
+        sources = animation
+        duration = animation.duration
+        total = len(animation)
     elif template.animated_text:
         sources = [source] * settings.MAXIMUM_FRAMES  # type: ignore
         duration = 250
@@ -424,13 +673,12 @@ def render_animation(
         if path and path.exists():
             timed_overlay_images[i] = load(path)
 
+    text_boxes: dict[tuple, list[tuple[Point, ImageType]]] = {}
     for index, frame in enumerate(sources):
         if (index % modulus) >= 1:
             continue
 
-        stream = io.BytesIO()
-        frame.save(stream, format="GIF")
-        background = Image.open(stream).convert("RGBA")
+        background = frame.convert("RGBA")
         image = resize_image(background, *size, pad, expand=False)
         percent_rendered = 1.0 if total == 1 else index / total
 
@@ -444,52 +692,22 @@ def render_animation(
                 continue
             composite_overlay_frame(image, overlay, foreground)
 
-        for (
-            point,
-            offset,
-            text,
-            max_text_size,
-            text_fill,
-            font,
-            align,
-            stroke_width,
-            stroke_fill,
-            angle,
-        ) in get_image_elements(
-            template,
-            lines,
-            font_name,
-            watermark,
-            image.size,
-            is_preview,
-            percent_rendered,
-        ):
-            box = Image.new("RGBA", max_text_size)
-            draw = ImageDraw.Draw(box)
-
-            if settings.DEBUG:
-                xy = (0, 0, max_text_size[0] - 1, max_text_size[1] - 1)
-                outline = "orange" if text == settings.PREVIEW_TEXT else "lime"
-                draw.rectangle(xy, outline=outline)
-
-            rows = text.count("\n") + 1
-            with emoji_support(box, draw, text) as draw:
-                draw.text(
-                    (-offset[0], -offset[1]),
-                    text,
-                    text_fill,
-                    font,
-                    spacing=-offset[1] / (rows * 2),
-                    align=align,
-                    stroke_width=stroke_width,
-                    stroke_fill=stroke_fill,
+        # Text layout only changes when a different set of lines is visible
+        state = image.size, get_visible_texts(template, percent_rendered)
+        if state not in text_boxes:
+            text_boxes[state] = [
+                (element[0], render_text_box(*element[1:]))
+                for element in get_image_elements(
+                    template,
+                    lines,
+                    font_name,
+                    watermark,
+                    image.size,
+                    is_preview,
+                    percent_rendered,
                 )
-
-            try:
-                box = box.rotate(angle, resample=Image.Resampling.LANCZOS, expand=True)
-            except ValueError as e:
-                logger.warning(e)
-                box = box.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True)
+            ]
+        for point, box in text_boxes[state]:
             image.paste(box, point, box)
 
         if settings.DEBUG:
@@ -499,7 +717,8 @@ def render_animation(
                 draw.rectangle(xy, outline="fuchsia")
 
         if pad:
-            image = add_blurred_background(image, background, *size)
+            key = None if animation else (source_path, source_path.stat().st_mtime_ns)
+            image = add_blurred_background(image, background, *size, key)
 
         if watermark:
             image = add_watermark(image, watermark, is_preview, index, total)
@@ -521,6 +740,41 @@ def render_animation(
     return frames, duration
 
 
+def render_text_box(
+    offset: Offset,
+    text: str,
+    max_text_size: Dimensions,
+    text_fill: str,
+    font: FontType,
+    align: Align,
+    stroke_width: int,
+    stroke_fill: str,
+    angle: float,
+) -> ImageType:
+    box = Image.new("RGBA", max_text_size)
+    draw = ImageDraw.Draw(box)
+
+    if settings.DEBUG:
+        xy = (0, 0, max_text_size[0] - 1, max_text_size[1] - 1)
+        outline = "orange" if text == settings.PREVIEW_TEXT else "lime"
+        draw.rectangle(xy, outline=outline)
+
+    rows = text.count("\n") + 1
+    with emoji_support(box, draw, text) as draw:
+        draw.text(
+            (-offset[0], -offset[1]),
+            text,
+            text_fill,
+            font,
+            spacing=-offset[1] / (rows * 2),
+            align=align,
+            stroke_width=stroke_width,
+            stroke_fill=stroke_fill,
+        )
+
+    return box.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True)
+
+
 def resize_image(
     image: ImageType, width: int, height: int, pad: bool = True, *, expand: bool
 ) -> ImageType:
@@ -559,7 +813,11 @@ def fit_image(width: float, height: float) -> tuple[int, int]:
 
 
 def add_blurred_background(
-    foreground: ImageType, background: ImageType, width: int, height: int
+    foreground: ImageType,
+    background: ImageType,
+    width: int,
+    height: int,
+    key: Hashable = None,
 ) -> ImageType:
     base_width, base_height = foreground.size
 
@@ -572,9 +830,7 @@ def add_blurred_background(
         ((border_width - base_width) // 2, (border_height - base_height) // 2),
     )
 
-    padded = background.resize((width, height), Image.Resampling.LANCZOS)
-    darkened = padded.point(lambda p: int(p * 0.4))
-    blurred = darkened.filter(ImageFilter.GaussianBlur(5))
+    blurred = get_blurred_background(background, width, height, key)
 
     blurred_width, blurred_height = blurred.size
     offset = (
@@ -586,20 +842,65 @@ def add_blurred_background(
     return blurred
 
 
+def get_blurred_background(
+    background: ImageType, width: int, height: int, key: Hashable = None
+) -> ImageType:
+    """Darkened and blurred background, cached when the source has a key."""
+    if key is not None:
+        image = BLURRED_BACKGROUNDS.get((key, width, height))
+        if image is not None:
+            return image.copy()
+
+    # Blurring hides detail, so blur a smaller copy and scale it back up
+    size = max(1, width // BLUR_SCALE), max(1, height // BLUR_SCALE)
+    image = background.resize(size, Image.Resampling.LANCZOS)
+    image = image.point(DARKEN * len(image.getbands()))
+    image = image.filter(ImageFilter.GaussianBlur(5 / BLUR_SCALE))
+    image = image.resize((width, height), Image.Resampling.BILINEAR)
+
+    if key is not None:
+        BLURRED_BACKGROUNDS.set((key, width, height), image)
+        return image.copy()
+    return image
+
+
 def add_watermark(
     image: ImageType, label: str, is_preview: bool, index: int = 0, total: int = 1
 ) -> ImageType:
+    sprite, top = get_watermark_sprite(label, image.size, is_preview)
+
+    if total == 1 or total >= settings.MAXIMUM_FRAMES:
+        fuzz = 0
+    elif index / total < 0.5:
+        fuzz = index
+    else:
+        fuzz = total - index - 1
+
+    image.alpha_composite(sprite, (fuzz, top))
+    return image
+
+
+def get_watermark_sprite(
+    label: str, image_size: Dimensions, is_preview: bool
+) -> tuple[ImageType, int]:
+    """Strip of the image covered by the label and its top edge."""
+    width, height = image_size
+    key = label, image_size, is_preview
+    sprite = WATERMARKS.get(key)
+    if sprite is not None:
+        return sprite
+
     if is_preview:
         text = Text.get_message()
         thick = True
-        size = (image.size[0], int(settings.WATERMARK_HEIGHT * 0.8))
+        size = (width, int(settings.WATERMARK_HEIGHT * 0.8))
     else:
         text = Text.get_watermark()
         thick = False
         if len(label) == 1:
-            size = (image.size[0], 1)
+            size = (width, 1)
         else:
-            size = (image.size[0], settings.WATERMARK_HEIGHT)
+            size = (width, settings.WATERMARK_HEIGHT)
 
     font = get_font("tiny", label, size, 99)
     offset = get_text_offset(label, font, size, is_watermark=is_preview)
@@ -607,17 +908,16 @@ def add_watermark(
     stroke_width = get_stroke_width(font)
     stroke_width, stroke_fill = text.get_stroke(stroke_width, thick=thick)
 
-    if total == 1 or total >= settings.MAXIMUM_FRAMES:
-        fuzz = 0
-    elif index / total < 0.5:
-        fuzz = index
-    else:
-        fuzz = total - index - 1
+    xy = 3, height - size[1] - offset[1]
+    draw = get_measuring_draw()
+    _, top, _, bottom = draw.textbbox(xy, label, font, stroke_width=stroke_width)
+    # Keep the drawing origin inside the strip so glyphs rasterize identically
+    top, bottom = min(math.floor(top) - 1, math.floor(xy[1])), math.ceil(bottom) + 1
 
-    box = Image.new("RGBA", image.size)
+    box = Image.new("RGBA", (width, bottom - top))
     draw = ImageDraw.Draw(box)
     draw.text(
-        (3 + fuzz, image.size[1] - size[1] - offset[1]),
+        (xy[0], xy[1] - top),
         label,
         text.color,
         font,
@@ -625,7 +925,8 @@ def add_watermark(
         stroke_fill=stroke_fill,
     )
 
-    return Image.alpha_composite(image, box)
+    WATERMARKS.set(key, (box, top))
+    return box, top
 
 
 def add_counter(
@@ -645,7 +946,12 @@ def add_counter(
 @contextmanager
 def emoji_support(image: ImageType, draw: DrawType, text: str):
     if emoji.emoji_count(text):
-        pilmoji = Pilmoji(image, render_discord_emoji=False, emoji_scale_factor=0.8)
+        pilmoji = Pilmoji(
+            image,
+            source=emojis.ATLAS,
+            render_discord_emoji=False,
+            emoji_scale_factor=0.8,
+        )
         yield pilmoji
         pilmoji.close()
     else:
@@ -664,11 +970,7 @@ def get_image_elements(
     tuple[Point, Offset, str, Dimensions, str, FontType, Align, int, str, float]
 ]:
     for index, text in enumerate(template.text):
-        if percent_rendered == 1.0:
-            yield get_image_element(
-                lines, index, text, font_name, image_size, watermark
-            )
-        elif text.start <= percent_rendered < text.stop or not text.stop:
+        if is_visible(text, percent_rendered):
             yield get_image_element(
                 lines, index, text, font_name, image_size, watermark
             )
@@ -681,6 +983,16 @@ def get_image_elements(
         yield get_image_element(lines, index, text, "", image_size, watermark)
 
 
+def get_visible_texts(template: Template, percent_rendered: float) -> tuple[bool, ...]:
+    return tuple(is_visible(text, percent_rendered) for text in template.text)
+
+
+def is_visible(text: Text, percent_rendered: float) -> bool:
+    if percent_rendered == 1.0:
+        return True
+    return text.start <= percent_rendered < text.stop or not text.stop
+
+
 def get_image_element(
     lines: list[str],
     index: int,
@@ -699,13 +1011,18 @@ def get_image_element(
     except IndexError:
         line = ""
     else:
-        line = text.stylize(
-            wrap(font_name or text.font, line, max_text_size, max_font_size),
-            lines=lines,
+        line = wrap(
+            font_name or text.font,
+            text.stylize(line, lines=lines),
+            max_text_size,
+            max_font_size,
         )
 
-    font = get_font(font_name or text.font, line, max_text_size, max_font_size)
-    offset = get_text_offset(line, font, max_text_size, text.align)
+    font_size, (x_offset, y_offset) = get_text_layout(
+        font_name or text.font, line, max_text_size, max_font_size, text.align
+    )
+    font = Font.objects.get(font_name or text.font).load(font_size)
+    offset = x_offset, y_offset
 
     stroke_width, stroke_fill = text.get_stroke(get_stroke_width(font))
 
@@ -723,88 +1040,163 @@ def get_image_element(
     )
 
 
-def _unsafe_wrap(text: str) -> bool:
-    for line in text.split("\n"):
-        stripped = line.strip()
-        if (
-            stripped
-            and emoji.emoji_count(stripped)
-            and not emoji.replace_emoji(stripped, replace="").strip()
-        ):
-            return True
-    return False
-
-
-def wrap(font: str, line: str, max_text_size: Dimensions, max_font_size: int) -> str:
-    lines_1 = line
-    lines_2 = split_2(line)
-    lines_3 = split_3(line)
-
-    font_1 = get_font(font, lines_1, max_text_size, max_font_size)
-    font_2 = get_font(font, lines_2, max_text_size, max_font_size)
-    font_3 = get_font(font, lines_3, max_text_size, max_font_size)
-
-    if font_1.size == font_2.size and font_2.size <= settings.MINIMUM_FONT_SIZE:
-        return lines_2
-
-    if font_1.size >= font_2.size:
-        return lines_1
-
-    if (
-        not _unsafe_wrap(lines_3)
-        and get_text_size(lines_3, font_3)[0] >= max_text_size[0] * 0.60
-    ):
-        return lines_3
-
-    if get_text_size(lines_2, font_2)[0] >= max_text_size[0] * 0.60:
-        return lines_2
-
-    return lines_1
-
-
-def split_2(line: str) -> str:
-    midpoint = len(line) // 2 - 1
-
-    for offset in range(0, len(line) // 4):
-        for index in [midpoint - offset, midpoint + offset]:
-            if line[index] == " ":
-                return line[:index].strip() + "\n" + line[index:].strip()
-
-    return line
+@LAYOUTS.memoize
+def get_text_layout(
+    font_name: str,
+    text: str,
+    max_text_size: Dimensions,
+    max_font_size: int,
+    align: str,
+) -> tuple[int, Offset]:
+    font = get_font(font_name, text, max_text_size, max_font_size)
+    offset = get_text_offset(text, font, max_text_size, align)
+    return font.size, offset  # type: ignore[return-value]
 
 
-def split_3(line: str) -> str:
-    max_len = len(line) / 3
-    words = line.split(" ")
-    lines = ["", "", ""]
-    index = 0
+def _emoji_only(word: str) -> bool:
+    return bool(emoji.emoji_count(word)) and not emoji.replace_emoji(word, "").strip()
 
-    for word in words:
-        current_len = len(lines[index])
-        next_len = current_len + len(word) * 0.7
-        if next_len > max_len:
-            if index < 2:
-                index += 1
 
-        lines[index] += word + " "
+@LAYOUTS.memoize
+def wrap(font: str, line: str, max_text_size: Dimensions, max_font_size: int) -> str:
+    words = line.split()
+    if "\n" in line or len(words) < 2:
+        return line
+
+    widths = [get_word_width(font, word) for word in words]
+    space = get_word_width(font, " ")
+    emojis = [_emoji_only(word) for word in words]
+
+    best, best_score = line, (0, 0.0, 0)
+    for breaks in split_lines(widths, space, settings.MAXIMUM_LINES):
+        rows = list(zip([0, *breaks], [*breaks, len(words)]))
+        if len(rows) > 1 and any(all(emojis[start:stop]) for start, stop in rows):
+            continue
 
-    return "\n".join(lines).strip()
+        if len(rows) == 1:
+            text = line
+        else:
+            text = "\n".join(" ".join(words[start:stop]) for start, stop in rows)
+        text_font = get_font(font, text, max_text_size, max_font_size)
+        score = (
+            int(text_font.size),
+            -get_text_overflow(text, text_font, max_text_size),
+            -len(rows),
+        )
+        if score > best_score:
+            best, best_score = text, score
+
+    return best
+
+
+def split_lines(widths: list[float], space: float, maximum: int) -> list[list[int]]:
+    """Break words into 1 to N lines, minimizing the width of the widest line."""
+    count = len(widths)
+    offsets = [0.0]
+    for width in widths:
+        offsets.append(offsets[-1] + width)
+
+    # costs[rows][stop]: narrowest layout of the first 'stop' words in 'rows' lines
+    costs = [[float("inf")] * (count + 1) for _ in range(maximum + 1)]
+    starts = [[0] * (count + 1) for _ in range(maximum + 1)]
+    costs[0][0] = 0.0
+    for rows in range(1, maximum + 1):
+        for stop in range(rows, count + 1):
+            for start in range(rows - 1, stop):
+                width = offsets[stop] - offsets[start] + space * (stop - start - 1)
+                cost = max(costs[rows - 1][start], width)
+                if cost < costs[rows][stop]:
+                    costs[rows][stop] = cost
+                    starts[rows][stop] = start
+
+    layouts = []
+    for rows in range(1, min(count, maximum) + 1):
+        breaks: list[int] = []
+        stop = count
+        for row in range(rows, 1, -1):
+            stop = starts[row][stop]
+            breaks.insert(0, stop)
+        layouts.append(breaks)
+
+    return layouts
+
+
+@lru_cache(maxsize=settings.LAYOUT_CACHE_SIZE)
+def get_word_width(font: str, word: str) -> float:
+    return Font.objects.get(font or settings.DEFAULT_FONT).load(100).getlength(word)
+
+
+def get_text_overflow(text: str, font: FontType, max_text_size: Dimensions) -> float:
+    text_width, text_height = get_text_size_minus_font_offset(text, font)
+    return max(
+        0.0,
+        text_width / max_text_size[0] - 1 if max_text_size[0] else 0.0,
+        text_height / max_text_size[1] - 1 if max_text_size[1] else 0.0,
+    )
 
 
 def get_font(
     name: str, text: str, max_text_size: Dimensions, max_font_size: int
 ) -> FontType:
-    font_path = Font.objects.get(name or settings.DEFAULT_FONT).path
+    font = Font.objects.get(name or settings.DEFAULT_FONT)
     max_text_width = max_text_size[0] - max_text_size[0] / 35
     max_text_height = max_text_size[1] - max_text_size[1] / 10
 
-    for size in range(max(settings.MINIMUM_FONT_SIZE, max_font_size), 6, -1):
-        font = ImageFont.truetype(str(font_path), size=size)
-        text_width, text_height = get_text_size_minus_font_offset(text, font)
-        if text_width <= max_text_width and text_height <= max_text_height:
-            break
+    def fits(size: int) -> bool:
+        text_width, text_height = get_text_size_minus_font_offset(text, font.load(size))
+        return text_width <= max_text_width and text_height <= max_text_height
 
-    return font
+    table = utils.glyphs.load(font.id)
+    size = find_font_size(
+        fits,
+        settings.MINIMUM_FONT_SIZE,
+        max(settings.MINIMUM_FONT_SIZE, max_font_size),
+        table.estimate_size(text, max_text_width, max_text_height) if table else 0,
+    )
+
+    return font.load(size)
+
+
+def find_font_size(
+    fits: Callable[[int], bool], minimum: int, maximum: int, estimate: int = 0
+) -> int:
+    """Find the largest size that fits, falling back to the minimum size."""
+    low, high = minimum, maximum
+
+    if estimate:
+        guess = min(max(estimate, minimum), maximum)
+        step = 1
+        if fits(guess):
+            low = guess
+            while low < high:
+                probe = min(guess + step, high)
+                if not fits(probe):
+                    high = probe - 1
+                    break
+                low = probe
+                step *= 2
+        else:
+            high = guess - 1
+            while low < high:
+                probe = max(guess - step, low)
+                if fits(probe):
+                    low = probe
+                    break
+                high = probe - 1
+                step *= 2
+    elif fits(maximum):
+        return maximum
+    else:
+        high = maximum - 1
+
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
 
 
 def get_text_size_minus_font_offset(text: str, font: FontType) -> Dimensions:
@@ -850,13 +1242,19 @@ def get_text_offset(
 
 
 def get_text_size(text: str, font: FontType) -> Dimensions:
-    image = Image.new("RGB", (100, 100))
-    draw = ImageDraw.Draw(image)
-    _, _, text_width, text_height = draw.textbbox((0, 0), text, font)
+    _, _, text_width, text_height = get_measuring_draw().textbbox((0, 0), text, font)
     stroke_width = get_stroke_width(font)
     return text_width + stroke_width, text_height + stroke_width  # type: ignore[return-value]
 
 
+def get_measuring_draw() -> DrawType:
+    # Measuring only reads font metrics, so each thread can reuse one canvas
+    draw = getattr(_measuring, "draw", None)
+    if draw is None:
+        draw = _measuring.draw = ImageDraw.Draw(Image.new("RGB", (100, 100)))
+    return draw
+
+
 def get_stroke_width(font: FontType) -> int:
     return min(3, max(1, int(font.size / 12)))
 
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import suppress
+from pathlib import Path
+
+from sanic.log import logger
+
+from .. import settings
+from . import text
+
+INTERVAL = 0.05
+
+
+class Lease:
+    """Lock file that lets one process on any node produce an artifact.
+
+    The lock is created with O_EXCL beside the artifact, so every process
+    sharing the directory, including other nodes on a network volume,
+    agrees on a single owner. Waiters poll until the owner releases the
+    lease or 'wait' seconds pass, then check for the artifact before
+    producing it themselves. Owners refresh the lock while they hold it, so
+    leases not refreshed for 'stale' seconds were left behind by a crashed
+    owner and are broken.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        wait: float = settings.LEASE_WAIT,
+        stale: float = settings.LEASE_STALE,
+    ):
+        self.path = path
+        self.wait = wait
+        self.stale = stale
+        self.lock = path.parent / f".{text.fingerprint(path.name, prefix='')}.lease"
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.acquired = self.waited = False
+
+    def acquire(self) -> bool:
+        self.lock.parent.mkdir(parents=True, exist_ok=True)
+        for _attempt in range(2):
+            try:
+                descriptor = os.open(
+                    self.lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644
+                )
+            except FileExistsError:
+                self._break_stale()
+                continue
+            with os.fdopen(descriptor, "w") as file:
+                file.write(self.token)
+            self.acquired = True
+            HEARTBEAT.add(self)
+            return True
+        return False
+
+    @property
+    def owner(self) -> str:
+        """Token of the process holding the lease, or "" when it's free."""
+        try:
+            return self.lock.read_text()
+        except FileNotFoundError:
+            return ""
+
+    def refresh(self):
+        """Mark the lease as alive so that waiters do not break it."""
+        with suppress(FileNotFoundError):
+            if self.lock.read_text() == self.token:
+                os.utime(self.lock)
+
+    def release(self):
+        if not self.acquired:
+            return
+        self.acquired = False
+        HEARTBEAT.discard(self)
+        with suppress(FileNotFoundError):
+            # Only remove our own lease, not one that replaced it after going stale
+            if self.lock.read_text() == self.token:
+                self.lock.unlink()
+
+    def _break_stale(self):
+        seen = self._get_state(self.lock)
+        if seen is None or time.time() - seen[1] / 1e9 < self.stale:
+            return
+
+        claimed = self.lock.with_name(f"{self.lock.name}.{uuid.uuid4().hex}")
+        try:
+            os.rename(self.lock, claimed)
+        except FileNotFoundError:
+            return
+
+        if self._get_state(claimed) != seen:
+            # Refreshed by its owner, or replaced by another breaker, since checked
+            with suppress(FileExistsError):
+                os.link(claimed, self.lock)
+        else:
+            logger.warning(f"Breaking stale lease on {self.path}")
+        claimed.unlink(missing_ok=True)
+
+    @staticmethod
+    def _get_state(path: Path) -> tuple[str, int] | None:
+        """Token and modification time of a lock, or None once it's gone."""
+        try:
+            token = path.read_text()
+            return token, path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _timed_out(self, deadline: float) -> bool:
+        self.waited = True
+        if time.monotonic() < deadline:
+            return False
+        logger.warning(f"Timed out waiting for lease on {self.path}")
+        return True
+
+    def __enter__(self) -> "Lease":
+        deadline = time.monotonic() + self.wait
+        while not self.acquire() and not self._timed_out(deadline):
+            time.sleep(INTERVAL)
+        return self
+
+    def __exit__(self, *_exception):
+        self.release()
+
+    async def hold(self) -> "Lease":
+        """Acquire the lease without blocking the event loop.
+
+        Each attempt runs in a thread, as the directory may be on a network
+        volume, and waiting between attempts yields to other requests.
+        """
+        deadline = time.monotonic() + self.wait
+        while not await asyncio.to_thread(self.acquire):
+            if self._timed_out(deadline):
+                break
+            await asyncio.sleep(INTERVAL)
+        return self
+
+    async def free(self):
+        """Release the lease without blocking the event loop."""
+        await asyncio.to_thread(self.release)
+
+    async def __aenter__(self) -> "Lease":
+        return await self.hold()
+
+    async def __aexit__(self, *_exception):
+        await self.free()
+
+
+class Heartbeat:
+    """Refreshes every held lease from one daemon thread.
+
+    Leases are refreshed four times per 'stale' period, so renders and
+    downloads that take longer than that keep their lease.
+    """
+
+    def __init__(self):
+        self.leases: set[Lease] = set()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def add(self, lease: Lease):
+        with self._condition:
+            self.leases.add(lease)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def discard(self, lease: Lease):
+        with self._condition:
+            self.leases.discard(lease)
+
+    def _run(self):
+        refreshed = time.monotonic()
+        while True:
+            with self._condition:
+                while not self.leases:
+                    self._condition.wait()
+                interval = min(lease.stale for lease in self.leases) / 4
+                remaining = refreshed + max(interval, INTERVAL) - time.monotonic()
+                if remaining > 0:
+                    # Woken when a lease is added, which may need refreshing sooner
+                    self._condition.wait(remaining)
+                    continue
+                leases = list(self.leases)
+            refreshed = time.monotonic()
+            for lease in leases:
+                try:
+                    lease.refresh()
+                except OSError as e:
+                    logger.warning(f"Unable to refresh lease on {lease.path}: {e}")
+
+
+HEARTBEAT = Heartbeat()
@@ -0,0 +1,155 @@
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+from sanic.log import logger
+
+from ..types import ImageType
+from . import text
+
+MAGIC = b"MEMEPX"
+HEADER = struct.Struct("<6s4sIIq")
+
+
+def dump(image: ImageType, path: Path, *, mtime: int = 0):
+    """Write uncompressed pixels so they can be mapped without decoding."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = HEADER.pack(MAGIC, image.mode.encode(), *image.size, mtime)
+    descriptor, temporary = tempfile.mkstemp(prefix=".", dir=path.parent)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            os.fchmod(file.fileno(), 0o644)
+            file.write(header)
+            file.write(image.tobytes())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load(path: Path, *, mtime: int | None = None) -> ImageType | None:
+    """Map pixels written by dump(), or None when missing, invalid, or stale."""
+    try:
+        with path.open("rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(buffer) < HEADER.size:
+        return None
+    magic, mode, width, height, source_mtime = HEADER.unpack_from(buffer)
+    if magic != MAGIC or (mtime is not None and mtime != source_mtime):
+        return None
+
+    mode = mode.rstrip(b"\0").decode()
+    data = memoryview(buffer)[HEADER.size :]
+    if len(data) != width * height * Image.getmodebands(mode):
+        return None
+    return Image.frombuffer(
+        mode, (width, height), data, "raw", mode, 0, 1  # type: ignore[arg-type]
+    )
+
+
+class Shared:
+    """Pixel files that every worker on a node maps instead of decoding.
+
+    The first worker to miss writes the file and the others attach to it.
+    Names include the source mtime, so edited sources get new files and
+    older versions are removed by the writer. A 'variant' keeps copies
+    derived from one source, such as resized ones, apart. When the
+    directory grows past 'maxsize' bytes, or past 'space' of what its
+    filesystem has left for it, the least recently written files are
+    removed; workers that already mapped them keep their pages until
+    released. A tmpfs can be much smaller than 'maxsize', such as the 64 MiB
+    that Docker gives /dev/shm by default.
+    Mapped files share the page cache, and a tmpfs such as /dev/shm keeps
+    them off disk entirely. The directory must be local to the node, since
+    mappings of files on a network filesystem are not kept coherent.
+    """
+
+    def __init__(self, directory: Path, maxsize: int, *, space: float = 0.5):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.space = space
+        self.hits = self.misses = self.writes = self.evictions = 0
+
+    def get(self, path: Path, mtime: int, variant: str = "") -> ImageType | None:
+        image = load(self._get_path(path, mtime, variant), mtime=mtime)
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return image
+
+    def set(self, path: Path, mtime: int, image: ImageType, variant: str = ""):
+        target = self._get_path(path, mtime, variant)
+        try:
+            dump(image, target, mtime=mtime)
+        except OSError as e:
+            logger.warning(f"Unable to share pixels for {path}: {e}")
+            self._shrink(None)
+            return
+        self.writes += 1
+
+        for stale in self.directory.glob(target.name.split("-")[0] + "-*.px"):
+            if stale != target:
+                stale.unlink(missing_ok=True)
+        self._shrink(target)
+
+    def stats(self) -> dict:
+        files = list(self.directory.glob("*.px"))
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "items": len(files),
+            "size": sum(_get_size(file) for file in files),
+            "maxsize": self.maxsize,
+        }
+
+    def _get_path(self, path: Path, mtime: int, variant: str) -> Path:
+        prefix = text.fingerprint(str(path.resolve()) + variant, prefix="")
+        return self.directory / f"{prefix}-{mtime}.px"
+
+    def _shrink(self, target: Path | None):
+        files = sorted(
+            self.directory.glob("*.px"),
+            key=lambda file: (file == target, _get_mtime(file)),
+            reverse=True,
+        )
+        sizes = [_get_size(file) for file in files]
+        maxsize = self._get_maxsize(sum(sizes))
+        size = 0
+        for file, file_size in zip(files, sizes):
+            size += file_size
+            if size > maxsize:
+                file.unlink(missing_ok=True)
+                self.evictions += 1
+
+    def _get_maxsize(self, size: int) -> int:
+        try:
+            stat = os.statvfs(self.directory)
+        except OSError:
+            return self.maxsize
+        available = size + stat.f_bavail * stat.f_frsize
+        return min(self.maxsize, int(available * self.space))
+
+
+def _get_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _get_mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
@@ -103,5 +103,10 @@ def fingerprint(value: str, *, prefix="_custom-", suffix="") -> str:
     return prefix + hashlib.sha1(value.encode()).hexdigest() + suffix
 
 
+def shards(filename: str) -> tuple[str, str]:
+    digest = hashlib.sha1(filename.encode()).hexdigest()
+    return digest[:2], digest[2:4]
+
+
 def slugify(value: str) -> str:
     return re.sub(r"[^a-z0-9-]", "", value).strip("-")
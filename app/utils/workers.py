@@ -0,0 +1,122 @@
+import asyncio
+import dataclasses
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing.reduction import ForkingPickler
+from typing import Any, Callable
+
+from sanic.exceptions import ServiceUnavailable
+from sanic.log import logger
+
+from .. import settings
+from ..models import Template
+from . import glyphs
+
+
+class Workers:
+    """Runs rendering in threads or in a pool of long-lived processes.
+
+    Threads share this process's caches but also its GIL. Processes are
+    spawned once and reused, so each keeps its own warm font, layout, and
+    background caches. At most 'queue_size' renders may be pending in this
+    process; beyond that, requests are rejected rather than queued.
+    """
+
+    def __init__(self, backend: str, processes: int, queue_size: int = 0):
+        self.backend = backend
+        self.processes = processes
+        self.queue_size = queue_size
+        self.pending = self.completed = self.failed = self.rejected = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            logger.info(f"Starting {self.processes} render process(es)")
+            self._executor = ProcessPoolExecutor(
+                self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize,
+            )
+        return self._executor
+
+    async def run(self, function: Callable, *args, **kwargs) -> Any:
+        if self.queue_size and self.pending >= self.queue_size:
+            self.rejected += 1
+            raise ServiceUnavailable("Too many images are being rendered")
+
+        self.pending += 1
+        try:
+            result = await self._run(function, *args, **kwargs)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    async def _run(self, function: Callable, *args, **kwargs) -> Any:
+        if self.backend == "process":
+            loop = asyncio.get_running_loop()
+            call = partial(function, *args, **kwargs)
+            try:
+                return await loop.run_in_executor(self.executor, call)
+            except BrokenProcessPool:
+                logger.error("Render process exited unexpectedly")
+                self.shutdown()
+                raise
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "processes": self.processes if self.backend == "process" else 0,
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_size": self.queue_size,
+        }
+
+
+def _initialize():
+    glyphs.load_all()
+
+
+def _reduce_template(template: Template):
+    # Datafiles attaches file hooks to models, so send plain values instead
+    fields = {
+        field.name: getattr(template, field.name)
+        for field in dataclasses.fields(template)
+    }
+    fields["keywords"] = list(fields["keywords"])
+    fields["example"] = list(fields["example"])
+    fields["text"] = [dataclasses.replace(text) for text in fields["text"]]
+    fields["overlay"] = [dataclasses.replace(item) for item in fields["overlay"]]
+    fields["directory"] = template.directory
+    return _restore_template, (fields,)
+
+
+def _restore_template(fields: dict) -> Template:
+    template = object.__new__(Template)
+    template.__dict__.update(fields)
+    return template
+
+
+ForkingPickler.register(Template, _reduce_template)
+
+WORKERS = Workers(
+    settings.RENDER_BACKEND, settings.RENDER_PROCESSES, settings.RENDER_QUEUE_SIZE
+)
+
+
+async def run(function: Callable, *args, **kwargs) -> Any:
+    return await WORKERS.run(function, *args, **kwargs)
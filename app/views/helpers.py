@@ -1,12 +1,23 @@
 import asyncio
+import hashlib
+import mimetypes
 from contextlib import suppress
+from functools import lru_cache
+from pathlib import Path
 
+from PIL import features
 from sanic import exceptions, response
 from sanic.log import logger
 from sanic.request import Request
 
 from .. import models, settings, utils
 
+MIME_TYPES = {".avif": "image/avif", ".webp": "image/webp"}
+
+RENDERS: dict[Path, asyncio.Future[bytes | None]] = {}
+PENDING_WRITES: dict[Path, bytes] = {}
+BACKGROUND_TASKS: set[asyncio.Task] = set()
+
 
 async def generate_url(
     request: Request,
@@ -132,7 +143,7 @@ async def preview_image(request: Request, id: str, style: str, lines: list[str])
     else:
         watermark = ""
 
-    data, content_type = await asyncio.to_thread(
+    data, content_type = await utils.workers.run(
         utils.images.preview, template, lines, style=style, watermark=watermark
     )
     return response.raw(data, content_type=content_type)
@@ -158,6 +169,11 @@ async def render_image(
         extension = settings.DEFAULT_STATIC_EXTENSION
         status = 422
 
+    headers = {}
+    if extension == "auto":
+        extension = negotiate_extension(request)
+        headers["Vary"] = "Accept"
+
     template: models.Template
     if any(len(part.encode()) > 200 for part in slug.split("/")):
         logger.error(f"Slug too long: {slug}")
@@ -236,32 +252,164 @@ async def render_image(
     if status < 400:
         asyncio.create_task(utils.meta.track(request, lines))
 
+    options = dict(
+        font_name=font_name,
+        extension=extension,
+        style=style,
+        size=size,
+        maximum_frames=frames,
+        animated=animated,
+    )
+
+    # Downloaded backgrounds and overlays can change behind the same URL
+    canonical = id != "custom" and not utils.urls.schema(style)
+
+    etag = ""
+    if status == 200 and canonical:
+        path = utils.images.get_path(template, lines, watermark, **options)
+        etag = await asyncio.to_thread(get_etag, template, path)
+        if etag_matches(request.headers.get("if-none-match", ""), etag):
+            headers.update(get_cache_headers(etag))
+            return response.empty(status=304, headers=headers)
+
     try:
-        path = await asyncio.to_thread(
-            utils.images.save,
-            template,
-            lines,
-            watermark,
-            font_name=font_name,
-            extension=extension,
-            style=style,
-            size=size,
-            maximum_frames=frames,
-        )
+        path, data = await render(template, lines, watermark, **options)
     except ValueError as e:
         logger.error(f"Unable to render text: {e}")
         if status < 400:
             status = 422
-        path = await asyncio.to_thread(
-            utils.images.save,
-            models.Template.objects.get("_error"),
-            lines,
-            watermark,
-            font_name=font_name,
-            extension=extension,
-            style=style,
-            size=size,
-            maximum_frames=frames,
+        template = models.Template.objects.get("_error")
+        path, data = await render(template, lines, watermark, **options)
+
+    if etag and status == 200:
+        headers.update(get_cache_headers(etag))
+    mime_type = get_mime_type(path.suffix)
+    if data is None:
+        return await response.file(path, status, mime_type=mime_type, headers=headers)
+    return response.raw(data, status, headers=headers, content_type=mime_type)
+
+
+async def render(
+    template: models.Template, lines: list[str], watermark: str, **options
+) -> tuple[Path, bytes | None]:
+    path = settings.IMAGES_DIRECTORY / utils.images.get_path(
+        template, lines, watermark, **options
+    )
+    if path in PENDING_WRITES:
+        logger.info(f"Loading meme from memory for {path}")
+        return path, PENDING_WRITES[path]
+    if path in RENDERS:
+        logger.info(f"Waiting for meme at {path}")
+    else:
+        flight = asyncio.ensure_future(
+            load(path, template, lines, watermark, **options)
         )
-    mime_type = "image/webp" if path.suffix == ".webp" else None
-    return await response.file(path, status, mime_type=mime_type)
+        RENDERS[path] = flight
+        flight.add_done_callback(lambda _flight: RENDERS.pop(path, None))
+    return path, await asyncio.shield(RENDERS[path])
+
+
+async def load(
+    path: Path, template: models.Template, lines: list[str], watermark: str, **options
+) -> bytes | None:
+    if await asyncio.to_thread(path.exists):
+        if settings.DEPLOYED:
+            logger.info(f"Loading meme from {path}")
+            utils.images.IMAGES.touch(path)
+            return None
+        logger.info(f"Rebuilding meme at {path}")
+    else:
+        logger.info(f"Saving meme to {path}")
+    return await encode(path, template, lines, watermark, **options)
+
+
+async def encode(
+    path: Path, template: models.Template, lines: list[str], watermark: str, **options
+) -> bytes:
+    lease = await utils.leases.Lease(path).hold()
+    try:
+        if lease.waited and await asyncio.to_thread(path.exists):
+            logger.info(f"Loading meme rendered by another process from {path}")
+            await lease.free()
+            return await asyncio.to_thread(path.read_bytes)
+        data = await utils.workers.run(
+            utils.images.encode, template, lines, watermark, **options
+        )
+        threshold = settings.IMAGES_ADMISSION_THRESHOLD
+        admit = utils.images.ADMISSION.admit
+        admitted = await asyncio.to_thread(admit, path.as_posix(), threshold)
+    except BaseException:
+        await asyncio.shield(lease.free())
+        raise
+
+    if not admitted:
+        logger.info(f"Skipped saving meme seen for the first time: {path}")
+        await lease.free()
+        return data
+
+    PENDING_WRITES[path] = data
+    task = asyncio.create_task(write(path, data, lease))
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return data
+
+
+async def write(path: Path, data: bytes, lease: utils.leases.Lease):
+    # Other processes wait on the lease, so hold it until the file exists
+    try:
+        await asyncio.to_thread(utils.images.write, path, data)
+    except OSError as e:
+        logger.error(f"Unable to save meme to {path}: {e}")
+    finally:
+        if PENDING_WRITES.get(path) is data:
+            del PENDING_WRITES[path]
+        await lease.free()
+
+
+def negotiate_extension(request: Request) -> str:
+    *extensions, fallback = settings.NEGOTIATED_EXTENSIONS
+    for extension in extensions:
+        # Only formats backed by an optional library may be missing
+        if extension in features.modules and not features.check_module(extension):
+            continue
+        mime_type = get_mime_type("." + extension)
+        match = request.accept.match(mime_type)
+        if match and match.header and match.header.mime == mime_type:
+            return extension
+    return fallback
+
+
+def get_mime_type(suffix: str) -> str:
+    mime_type = MIME_TYPES.get(suffix) or mimetypes.guess_type("_" + suffix)[0]
+    return mime_type or "image/png"
+
+
+def get_etag(template: models.Template, path: Path) -> str:
+    """Validator covering the request, the template's files, and the layout code."""
+    identifiers = [path.as_posix(), utils.images.LAYOUTS.version]
+    with suppress(FileNotFoundError):
+        for source in sorted(template.directory.iterdir()):
+            if source.name.startswith((".", "_")):  # compiled or temporary files
+                continue
+            stat = source.stat()
+            digest = get_digest(source, stat.st_mtime_ns, stat.st_size)
+            identifiers.append(f"{source.name}:{digest}")
+    return '"' + utils.text.fingerprint("|".join(identifiers), prefix="") + '"'
+
+
+@lru_cache(maxsize=1024)
+def get_digest(path: Path, _mtime: int, _size: int) -> str:
+    # Hash contents rather than use mtimes, which differ between nodes
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def etag_matches(value: str, etag: str) -> bool:
+    if value.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in value.split(",")]
+    return etag in tags
+
+
+def get_cache_headers(etag: str) -> dict[str, str]:
+    max_age = settings.IMAGE_CACHE_MAX_AGE
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}, immutable"}
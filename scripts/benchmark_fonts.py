@@ -0,0 +1,82 @@
+"""
+poetry run python -m scripts.benchmark_fonts
+"""
+
+import sys
+import time
+
+from PIL import ImageFont
+
+from app import settings, utils
+from app.models import Font, Template
+
+
+def linear_search(name, text, max_text_size, max_font_size):
+    font_path = Font.objects.get(name or settings.DEFAULT_FONT).path
+    max_text_width = max_text_size[0] - max_text_size[0] / 35
+    max_text_height = max_text_size[1] - max_text_size[1] / 10
+
+    for size in range(max(settings.MINIMUM_FONT_SIZE, max_font_size), 6, -1):
+        font = ImageFont.truetype(str(font_path), size=size)
+        text_width, text_height = utils.images.get_text_size_minus_font_offset(
+            text, font
+        )
+        if text_width <= max_text_width and text_height <= max_text_height:
+            break
+
+    return font
+
+
+def collect_calls() -> list[tuple]:
+    calls = []
+    get_font = utils.images.get_font
+
+    def record(*args):
+        calls.append(args)
+        return get_font(*args)
+
+    # Stored layouts would skip the fitting on every run after the first
+    layouts = utils.images.LAYOUTS
+    setattr(layouts, "get", lambda key: None)
+    setattr(layouts, "set", lambda key, value: None)
+    utils.images.get_font = record  # type: ignore[assignment]
+    try:
+        for id, lines, extension in settings.TEST_IMAGES:
+            template = Template.objects.get(id)
+            for size in [(0, 0), settings.PREVIEW_SIZE, (0, 1080)]:
+                if extension in settings.ANIMATED_EXTENSIONS:
+                    utils.images.render_animation(template, "default", lines, size)
+                else:
+                    utils.images.render_image(template, "default", lines, size)
+    finally:
+        utils.images.get_font = get_font  # type: ignore[assignment]
+        del layouts.get, layouts.set
+
+    return calls
+
+
+def measure(function, calls: list[tuple]) -> tuple[float, list[int]]:
+    start = time.perf_counter()
+    sizes = [function(*args).size for args in calls]
+    return time.perf_counter() - start, sizes
+
+
+def main():
+    calls = collect_calls()
+    if not calls:
+        sys.exit("No font fittings collected")
+    count = len(settings.TEST_IMAGES)
+    print(f"Collected {len(calls)} font fittings from {count} test images")
+
+    linear_time, linear_sizes = measure(linear_search, calls)
+    print(f"Linear search: {linear_time * 1000:.0f} ms")
+
+    fitted_time, fitted_sizes = measure(utils.images.get_font, calls)
+    print(f"Bounded search: {fitted_time * 1000:.0f} ms")
+
+    mismatches = sum(a != b for a, b in zip(linear_sizes, fitted_sizes))
+    print(f"Speedup: {linear_time / fitted_time:.1f}x ({mismatches} mismatches)")
+
+
+if __name__ == "__main__":
+    main()
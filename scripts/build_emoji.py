@@ -0,0 +1,56 @@
+"""
+poetry run python -m scripts.build_emoji
+"""
+
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import emoji
+from PIL import Image, UnidentifiedImageError
+from pilmoji.source import Twemoji
+
+from app import settings, utils
+
+ATTEMPTS = 3
+WORKERS = 16
+MAXIMUM_MISSING = 0.1  # the newest emoji may not be in Twemoji yet
+
+
+def download(source: Twemoji, character: str) -> Image.Image | None:
+    for attempt in range(ATTEMPTS):
+        data = utils.emojis.fetch(source, character)
+        if data:
+            try:
+                return Image.open(io.BytesIO(data))
+            except UnidentifiedImageError:
+                pass
+        if attempt + 1 < ATTEMPTS:
+            time.sleep(2**attempt)
+    return None
+
+
+def main():
+    source = Twemoji()
+    characters = [
+        character
+        for character, data in emoji.EMOJI_DATA.items()
+        if data["status"] <= emoji.STATUS["fully_qualified"]
+    ]
+    with ThreadPoolExecutor(WORKERS) as executor:
+        images = list(executor.map(lambda c: download(source, c), characters))
+
+    missing = [c for c, image in zip(characters, images) if image is None]
+    for character in missing:
+        print(f"No image for {emoji.EMOJI_DATA[character]['en']}")
+    if len(missing) > len(characters) * MAXIMUM_MISSING:
+        sys.exit(f"Missing {len(missing)} of {len(characters)} emoji, not saving")
+
+    downloaded = [(c, image) for c, image in zip(characters, images) if image]
+    count = utils.emojis.build(downloaded, settings.EMOJI_ATLAS)
+    print(f"Saved {count} emoji to {settings.EMOJI_ATLAS}")
+
+
+if __name__ == "__main__":
+    main()
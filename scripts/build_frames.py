@@ -0,0 +1,20 @@
+"""
+poetry run python -m scripts.build_frames
+"""
+
+from app import utils
+from app.models import Template
+
+
+def main():
+    for template in Template.objects.filter(valid=True, _exclude="_custom"):
+        if not template.animated_image:
+            continue
+        path = template.get_image(animated=True)
+        animation = utils.frames.load(path)
+        count = len(animation) if animation else 0
+        print(f"Extracted {count} frame(s) for {template.id} from {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+poetry run python -m scripts.build_glyphs
+"""
+
+import json
+
+from app import utils
+from app.models import Font
+
+
+def main():
+    utils.glyphs.DIRECTORY.mkdir(exist_ok=True)
+    for font in Font.objects.all():
+        path = utils.glyphs.DIRECTORY / f"{font.id}.json"
+        data = utils.glyphs.build(font.filename)
+        path.write_text(json.dumps(data, separators=(",", ":")) + "\n")
+        print(f"Saved {len(data['kerning'])} kerning pair(s) for {font.id} to {path}")
+
+
+if __name__ == "__main__":
+    main()
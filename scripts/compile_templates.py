@@ -0,0 +1,26 @@
+"""
+poetry run python -m scripts.compile_templates [template_id ...]
+"""
+
+import sys
+
+from app import utils
+from app.models import Template
+
+
+def main(*ids: str):
+    templates = Template.objects.filter(valid=True, _exclude="_custom")
+    for template in templates:
+        if ids and template.id not in ids:
+            continue
+        styles = [style for style in template.styles if style != "animated"]
+        paths = {template.get_image(style) for style in styles}
+        paths.add(template.image)
+        for path in sorted(paths):
+            if path.exists():
+                compiled_path = utils.images.compile_image(path)
+                print(f"Compiled {path} to {compiled_path.name}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,19 @@
+"""
+poetry run python -m scripts.shard_images [directory]
+"""
+
+import sys
+from pathlib import Path
+
+from app import settings, utils
+
+
+def main(directory: Path = settings.IMAGES_DIRECTORY):
+    count = utils.images.shard(directory)
+    if directory == settings.IMAGES_DIRECTORY:
+        utils.images.IMAGES.scan()
+    print(f"Moved {count} image(s) into filename shards in {directory}")
+
+
+if __name__ == "__main__":
+    main(*map(Path, sys.argv[1:]))